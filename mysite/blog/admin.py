@@ -1,15 +1,45 @@
 from django.contrib import admin
+from django.contrib.postgres.search import SearchQuery
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Comment, Post
+from .cache import invalidate
+from .changelist import FastChangeListMixin
+from .export import COMMENT_FIELDS, POST_FIELDS, export_response
+from .models import COMMENT_SEARCH_VECTOR, Comment, OutgoingEmail, Post
 
 # admin.site.register(Post)
 
 
+class ExportActionsMixin:
+    """
+    Admin actions streaming the selected rows (or, with "select all", the
+    whole filtered changelist) as CSV or JSONL, see blog.export.
+    """
+    export_fields = []
+    actions = ['export_as_csv', 'export_as_jsonl']
+
+    def export(self, request, queryset, format):
+        filename = self.model._meta.verbose_name_plural.replace(' ', '_')
+        return export_response(queryset, self.export_fields, format, filename, request)
+
+    @admin.action(description='Export selected %(verbose_name_plural)s as CSV')
+    def export_as_csv(self, request, queryset):
+        return self.export(request, queryset, 'csv')
+
+    @admin.action(description='Export selected %(verbose_name_plural)s as JSONL')
+    def export_as_jsonl(self, request, queryset):
+        return self.export(request, queryset, 'jsonl')
+
+
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(FastChangeListMixin, ExportActionsMixin, admin.ModelAdmin):
     list_display = ['title', 'slug', 'author', 'publish', 'status']
+    list_select_related = ['author']
     list_filter = ['status', 'created', 'publish', 'author']
+    # searched through the indexed search_vector, see get_search_results()
     search_fields = ['title', 'body']
+    search_help_text = 'Full-text search in titles and bodies, e.g. django -draft or "exact phrase".'
     # auto generate slug with title
     prepopulated_fields = {'slug': ('title',)}
     # show id instead of name for author, better when have tons of users
@@ -17,12 +47,63 @@ class PostAdmin(admin.ModelAdmin):
     # show a row of date selection
     date_hierarchy = 'publish'
     ordering = ['status', 'publish']
-    # show facet filters counts
+    # show facet filters counts (cached, see blog.changelist)
     show_facets = admin.ShowFacets.ALWAYS
+    export_fields = POST_FIELDS
+
+    def get_search_results(self, request, queryset, search_term):
+        # One GIN index lookup instead of LIKE '%term%' over every title and body
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search_vector=SearchQuery(search_term, search_type='websearch')), False
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FastChangeListMixin, ExportActionsMixin, admin.ModelAdmin):
     list_display = ['name', 'email', 'post', 'created', 'active']
+    # the post column would otherwise load each comment's post separately
+    list_select_related = ['post']
     list_filter = ['active', 'created', 'updated']
+    # searched through indexes, see get_search_results()
     search_fields = ['name', 'email', 'body']
+    search_help_text = 'An email address, or words of the name or body of the comment.'
+    actions = ['activate_comments', 'deactivate_comments', *ExportActionsMixin.actions]
+    export_fields = COMMENT_FIELDS
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if '@' in search_term:
+            return queryset.filter(email=search_term), False
+        # Matches the expression of the blog_comment_search_idx GIN index
+        return (queryset.annotate(search_vector=COMMENT_SEARCH_VECTOR)
+                .filter(search_vector=SearchQuery(search_term, config='english', search_type='websearch'))), False
+
+    def set_active(self, queryset, active):
+        # Bulk update, then recount only the affected posts in one UPDATE
+        with transaction.atomic():
+            changed = queryset.exclude(active=active)
+            post_ids = set(changed.values_list('post_id', flat=True))
+            # bump updated like save() would, post_detail validators depend on it
+            updated = changed.update(active=active, updated=timezone.now())
+            Post.objects.filter(id__in=post_ids).update_comment_counts()
+        invalidate('sidebar')
+        return updated
+
+    @admin.action(description='Activate selected comments')
+    def activate_comments(self, request, queryset):
+        updated = self.set_active(queryset, True)
+        self.message_user(request, f'{updated} comment(s) activated.')
+
+    @admin.action(description='Deactivate selected comments')
+    def deactivate_comments(self, request, queryset):
+        updated = self.set_active(queryset, False)
+        self.message_user(request, f'{updated} comment(s) deactivated.')
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt', 'created', 'sent']
+    list_filter = ['status']
+    readonly_fields = ['attempts', 'last_error', 'created', 'sent']
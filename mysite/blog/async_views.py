@@ -0,0 +1,133 @@
+"""
+Async versions of the post list, detail and search views, served instead of
+the blog.views ones when settings.BLOG_ASYNC_VIEWS is on (off by default,
+see the requirements in mysite/settings.py).
+
+The async ORM methods (aget, acount, async for...) run the queries one at a
+time on the single thread-sensitive executor, so awaiting several of them
+together saves nothing. Independent queries run through concurrently()
+instead, each in a worker thread with its own database connection (kept
+between requests only with CONN_MAX_AGE). Queries that depend on another
+result, like the post before its comments, still await in sequence.
+"""
+
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.shortcuts import aget_object_or_404, render
+from mysite.db_routing import read_only_view
+from mysite.query_budget import declare_query_budget
+from taggit.models import Tag
+
+from .conditional import conditional_view, post_detail_validators, post_list_validators
+from .forms import CommentForm, SearchForm
+from .models import Post
+from .pagecache import add_surrogate_keys, cache_anonymous_page, post_key, tag_key
+from .templatetags.blog_tags import SIDEBAR_LOADERS
+from .search import search_page
+from .views import get_similar_posts, paginate_comments, paginate_posts
+
+
+def _in_worker(func):
+    @functools.wraps(func)
+    def run():
+        try:
+            return func()
+        finally:
+            # Like at the end of a request: the worker's connection is closed,
+            # or kept for reuse with CONN_MAX_AGE
+            close_old_connections()
+    return run
+
+
+async def concurrently(*funcs):
+    """
+    Run the synchronous `funcs` at the same time in worker threads and
+    return their results, in order.
+    """
+    return await asyncio.gather(*(
+        sync_to_async(_in_worker(func), thread_sensitive=False)() for func in funcs))
+
+
+@declare_query_budget(6)
+@read_only_view
+@conditional_view(post_list_validators)
+@cache_anonymous_page
+async def post_list(request, tag_slug=None):
+    post_list = Post.published.select_related('author').prefetch_related('tags')
+
+    tag = None
+    if tag_slug:
+        tag = await aget_object_or_404(Tag, slug=tag_slug)
+        post_list = post_list.filter(tags__in=[tag])
+
+    # The page (and the tags of its posts) while the sidebar loads
+    (paginator, posts), *_ = await concurrently(
+        lambda: paginate_posts(request, post_list, 3), *SIDEBAR_LOADERS)
+
+    add_surrogate_keys(request, tag_key(tag.slug) if tag else 'list',
+                       *(post_key(post.id) for post in posts),
+                       *(tag_key(t.slug) for post in posts for t in post.tags.all()))
+
+    return await sync_to_async(render)(request, 'blog/post/list.html', {
+        'posts': posts,
+        'tag': tag
+    })
+
+
+@declare_query_budget(7)
+@read_only_view
+@conditional_view(post_detail_validators)
+@cache_anonymous_page
+async def post_detail(request, year, month, day, post):
+    post = await aget_object_or_404(Post.objects.select_related('author'),
+                                    status=Post.Status.PUBLISHED,
+                                    slug=post,
+                                    publish__year=year,
+                                    publish__month=month,
+                                    publish__day=day,
+                                    )
+
+    # Comments, similar posts and sidebar only need the post, fetch them together
+    comments, similar_posts, *_ = await concurrently(
+        lambda: paginate_comments(post),
+        lambda: get_similar_posts(post),
+        *SIDEBAR_LOADERS)
+
+    add_surrogate_keys(request, post_key(post.id),
+                       *(post_key(similar.id) for similar in similar_posts))
+
+    return await sync_to_async(render)(request, 'blog/post/detail.html', {
+        'post': post,
+        'comments': comments,
+        'form': CommentForm(),
+        'similar_posts': similar_posts,
+    })
+
+
+@declare_query_budget(5)
+@read_only_view
+async def post_search(request):
+    form = SearchForm()
+    query = None
+    results = []
+
+    if 'query' in request.GET:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data['query']
+
+    # The matches while the sidebar loads
+    if query is not None:
+        results, *_ = await concurrently(
+            lambda: search_page(query, request.GET.get('page')), *SIDEBAR_LOADERS)
+    else:
+        await concurrently(*SIDEBAR_LOADERS)
+
+    return await sync_to_async(render)(request, 'blog/post/search.html', {
+        'form': form,
+        'query': query,
+        'results': results
+    })
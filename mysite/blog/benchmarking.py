@@ -0,0 +1,253 @@
+"""
+Helpers shared by the `bench` and `loadtest` management commands: seeding a
+synthetic corpus and the list of requests covering every named URL of the
+blog and polls apps.
+"""
+
+import datetime
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from polls.models import Choice, Question
+from taggit.models import Tag, TaggedItem
+
+from .markup import render_post_body
+from .models import POST_SEARCH_VECTOR, Comment, Post, SimilarPost, TagCount
+
+WORDS = ('django', 'python', 'postgres', 'index', 'query', 'cache', 'template',
+         'view', 'model', 'search', 'feed', 'tag', 'comment', 'post', 'blog',
+         'server', 'request', 'response', 'latency', 'worker')
+
+Corpus = namedtuple('Corpus', ['post', 'tag', 'question', 'choice', 'staff'])
+
+# Views behind staff_member_required, requested by a logged-in staff user
+# (anonymously they only time the redirect to the admin login)
+STAFF_URLS = {'blog:export'}
+
+
+def seed_corpus(posts=200, tags=20, comments_per_post=5, questions=20,
+                choices_per_question=4, seed=0):
+    """
+    Fill the database with a synthetic corpus using bulk inserts, and return
+    a Corpus of sample objects to build URLs from. The same `seed` always
+    gives the same corpus.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    author, _ = User.objects.get_or_create(username='bench-author')
+    staff, _ = User.objects.get_or_create(username='bench-staff',
+                                          defaults={'is_staff': True, 'is_superuser': True})
+
+    tag_objs = Tag.objects.bulk_create(
+        [Tag(name=f'{WORDS[i % len(WORDS)]}{i}', slug=f'{WORDS[i % len(WORDS)]}{i}')
+         for i in range(tags)])
+
+    post_objs = []
+    for i in range(posts):
+        body = '\n\n'.join(' '.join(rng.choices(WORDS, k=40)).capitalize() + '.'
+                           for _ in range(3))
+        body_html, excerpt_html = render_post_body(body)
+        post_objs.append(Post(title=f'{" ".join(rng.choices(WORDS, k=3)).title()} {i}',
+                              slug=f'bench-post-{i}', author=author, body=body,
+                              body_html=body_html, excerpt_html=excerpt_html,
+                              status=Post.Status.PUBLISHED,
+                              publish=now - datetime.timedelta(hours=i)))
+    # bulk_create skips Post.save() and the signals, the derived columns
+    # are filled in set-wise below
+    Post.objects.bulk_create(post_objs, batch_size=1000)
+    post_ids = [post.id for post in post_objs]
+    Post.objects.filter(id__in=post_ids).update(search_vector=POST_SEARCH_VECTOR)
+
+    content_type = ContentType.objects.get_for_model(Post)
+    TaggedItem.objects.bulk_create(
+        [TaggedItem(content_type=content_type, object_id=post.id, tag=tag)
+         for post in post_objs
+         for tag in rng.sample(tag_objs, k=min(3, len(tag_objs)))],
+        batch_size=1000)
+
+    Comment.objects.bulk_create(
+        [Comment(post=post, name=f'Reader {j}', email='reader@example.com',
+                 body=' '.join(rng.choices(WORDS, k=20)))
+         for post in post_objs for j in range(comments_per_post)],
+        batch_size=1000)
+    Post.objects.filter(id__in=post_ids).update_comment_counts()
+    for start in range(0, len(post_ids), 1000):
+        SimilarPost.objects.rebuild(post_ids[start:start + 1000])
+    TagCount.objects.rebuild()
+
+    question_objs = Question.objects.bulk_create(
+        [Question(question_text=f'{" ".join(rng.choices(WORDS, k=5)).capitalize()}?',
+                  pub_date=now - datetime.timedelta(hours=i + 1))
+         for i in range(questions)])
+    choice_objs = Choice.objects.bulk_create(
+        [Choice(question=question, choice_text=f'Choice {j}')
+         for question in question_objs for j in range(choices_per_question)])
+
+    cache.clear()
+    return Corpus(post=post_objs[0] if post_objs else None,
+                  tag=tag_objs[0] if tag_objs else None,
+                  question=question_objs[0] if question_objs else None,
+                  choice=choice_objs[0] if choice_objs else None,
+                  staff=staff)
+
+
+def named_urls():
+    """
+    Yield the namespaced name of every named URL of the blog and polls apps.
+    """
+    from blog import urls as blog_urls
+    from polls import urls as polls_urls
+
+    for urlconf in (blog_urls, polls_urls):
+        for pattern in urlconf.urlpatterns:
+            if not isinstance(pattern, URLResolver) and pattern.name:
+                yield f'{urlconf.app_name}:{pattern.name}'
+
+
+def url_requests(corpus):
+    """
+    Return {url name: (method, url, data)}, one representative request per
+    named URL, built from the sample objects of `corpus`.
+    """
+    post, tag, question = corpus.post, corpus.tag, corpus.question
+    question_args = [question.id]
+    return {
+        'blog:post_list': ('get', reverse('blog:post_list'), {}),
+        'blog:post_list_by_tag': ('get', reverse('blog:post_list_by_tag', args=[tag.slug]), {}),
+        'blog:tag_list': ('get', reverse('blog:tag_list'), {}),
+        'blog:post_feed_by_tag': ('get', reverse('blog:post_feed_by_tag', args=[tag.slug]), {}),
+        'blog:post_detail': ('get', post.get_absolute_url(), {}),
+        'blog:post_share': ('get', reverse('blog:post_share', args=[post.id]), {}),
+        'blog:post_comment': ('post', reverse('blog:post_comment', args=[post.id]),
+                              {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi'}),
+        'blog:post_comments': ('get', reverse('blog:post_comments', args=[post.id]), {}),
+        'blog:post_feed': ('get', reverse('blog:post_feed'), {}),
+        'blog:post_search': ('get', reverse('blog:post_search'), {'query': WORDS[0]}),
+        'blog:post_autocomplete': ('get', reverse('blog:post_autocomplete'), {'q': WORDS[0][:3]}),
+        'blog:export': ('get', reverse('blog:export', args=['comments', 'csv']), {}),
+        'polls:index': ('get', reverse('polls:index'), {}),
+        'polls:detail': ('get', reverse('polls:detail', args=question_args), {}),
+        'polls:results': ('get', reverse('polls:results', args=question_args), {}),
+        'polls:vote': ('post', reverse('polls:vote', args=question_args),
+                       {'choice': corpus.choice.id}),
+    }
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank `p`th percentile of an already sorted list.
+    """
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(timings_ms):
+    """
+    Return p50/p95/p99/mean/max of a list of latencies in milliseconds.
+    """
+    timings_ms = sorted(timings_ms)
+    return {
+        'p50_ms': percentile(timings_ms, 50),
+        'p95_ms': percentile(timings_ms, 95),
+        'p99_ms': percentile(timings_ms, 99),
+        'mean_ms': sum(timings_ms) / len(timings_ms),
+        'max_ms': timings_ms[-1],
+    }
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and their time, more precise
+    than the millisecond-rounded times of connection.queries.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def run_benchmark(client, requests, iterations=50, warmup=5, cold=False, staff=None):
+    """
+    Send every request of `requests` ({name: (method, url, data)})
+    `iterations` times through the test `client`, after `warmup` unmeasured
+    runs. With `cold` the cache is cleared before every request. The
+    STAFF_URLS are sent by a second client logged in as `staff`, and
+    skipped without one. Return {name: stats}.
+    """
+    staff_client = None
+    if staff is not None:
+        staff_client = type(client)()
+        staff_client.force_login(staff)
+    results = {}
+    for name, (method, url, data) in requests.items():
+        if name in STAFF_URLS:
+            if staff_client is None:
+                continue
+            send = getattr(staff_client, method)
+        else:
+            send = getattr(client, method)
+        for _ in range(warmup):
+            if cold:
+                cache.clear()
+            send(url, data)
+
+        timings, queries, sql_ms, errors = [], [], [], 0
+        for _ in range(iterations):
+            if cold:
+                cache.clear()
+            timer = QueryTimer()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                response = send(url, data)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(timer.count)
+            sql_ms.append(timer.seconds * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+        results[name] = {
+            'method': method.upper(),
+            'url': url,
+            'iterations': iterations,
+            **summarize(timings),
+            'queries': sum(queries) / iterations,
+            'sql_ms': sum(sql_ms) / iterations,
+            'errors': errors,
+        }
+    return results
+
+
+def compare_results(results, baseline, threshold=10.0, metric='p95_ms'):
+    """
+    Compare two {name: stats} runs. Return a list of
+    (name, description) for every URL whose `metric` grew by more than
+    `threshold` percent or which runs more queries than in `baseline`.
+    """
+    regressions = []
+    for name, stats in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if before[metric] and stats[metric] > before[metric] * (1 + threshold / 100):
+            change = (stats[metric] / before[metric] - 1) * 100
+            regressions.append((name, f'{metric} {before[metric]:.2f} -> '
+                                      f'{stats[metric]:.2f} (+{change:.0f}%)'))
+        if stats['queries'] > before['queries']:
+            regressions.append((name, f'queries {before["queries"]:g} -> {stats["queries"]:g}'))
+    return regressions
@@ -0,0 +1,99 @@
+"""
+Versioned cache namespaces.
+
+Every cached value lives under a key that embeds the current version of its
+namespace ("sidebar", "posts", ...). Invalidating a namespace only bumps the
+version, so all of its keys go stale at once without having to know or delete
+them. Versions are nanosecond timestamps of the last invalidation, which also
+makes them usable as Last-Modified dates.
+
+The replica may not have a change yet when its version is bumped, so values
+filled within REPLICA_LAG_SECONDS of a bump are computed from the primary,
+see mysite.db_routing.
+"""
+
+import datetime
+import time
+
+from django.core.cache import cache, caches
+from django.db import transaction
+from mysite.db_routing import REPLICA_LAG_SECONDS, reading_from_primary
+
+_missing = object()
+
+
+def _version_key(namespace):
+    return f'blog:version:{namespace}'
+
+
+def get_version(namespace):
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1 so an evicted version key can
+        # never bring back entries cached under an older version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(namespaces):
+    """
+    Return {namespace: version} for several namespaces with one cache read.
+    """
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for namespace in keys.values():
+        if namespace not in versions:
+            versions[namespace] = get_version(namespace)
+    return versions
+
+
+def changed_recently(versions):
+    """
+    Return whether any of `versions` was bumped within the replica lag.
+    """
+    return time.time_ns() - max(versions, default=0) < REPLICA_LAG_SECONDS * 10**9
+
+
+def version_timestamp(namespace):
+    """
+    Return the time of the last invalidation of `namespace` as an aware datetime.
+    """
+    return datetime.datetime.fromtimestamp(get_version(namespace) / 1e9, datetime.timezone.utc)
+
+
+def invalidate(*namespaces):
+    """
+    Bump the versions of `namespaces` once the current transaction commits
+    (right away outside of one). Bumped earlier, a request running before
+    the commit would cache the old data under the new version, and keep
+    serving it until the next invalidation.
+    """
+    def bump():
+        now = time.time_ns()
+        cache.set_many({_version_key(namespace): now for namespace in namespaces}, None)
+    transaction.on_commit(bump)
+
+
+def cached(namespace, name, compute, timeout=None, using='default'):
+    """
+    Return the value cached as `name` in `namespace` (or a tuple of
+    namespaces it depends on), calling `compute()` to fill it on a miss.
+    `timeout` of None keeps it until invalidated, DEFAULT_TIMEOUT uses the
+    timeout of the `using` cache. Versions always live in the default cache.
+    """
+    namespaces = (namespace,) if isinstance(namespace, str) else namespace
+    versions = get_versions(namespaces)
+    key = 'blog:{}:{}'.format(':'.join(f'{n}.{versions[n]}' for n in namespaces), name)
+    backend = caches[using]
+    value = backend.get(key, _missing)
+    if value is _missing:
+        if changed_recently(versions.values()):
+            # the replica may not have the change yet
+            with reading_from_primary():
+                value = compute()
+        else:
+            value = compute()
+        backend.set(key, value, timeout)
+    return value
@@ -0,0 +1,106 @@
+"""
+Conditional GET support (ETag / Last-Modified) for blog pages, the feed and
+the sitemap.
+
+Validators are derived from Post.updated, the latest comment change and the
+versions of the "posts", "tags" and "sidebar" cache namespaces (see
+blog.cache), so an unchanged resource is answered with a 304 before the
+view renders anything.
+"""
+
+import functools
+import hashlib
+from collections import namedtuple
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import Max
+from django.views.decorators.http import condition
+from mysite.db_routing import reads_from_replica
+
+from .cache import changed_recently, get_version, version_timestamp
+from .models import Post
+
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
+
+
+def make_validators(parts, namespaces, timestamps=()):
+    """
+    Build validators from `parts` (values identifying the content), the cache
+    `namespaces` the content depends on, and extra `timestamps`. Returns None
+    while a page rendered from the replica could still miss a recent change,
+    so clients don't keep it under the new validators.
+    """
+    versions = [get_version(namespace) for namespace in namespaces]
+    if reads_from_replica() and changed_recently(versions):
+        return None
+    etag = hashlib.md5(repr([*parts, *versions]).encode()).hexdigest()
+    last_modified = max([version_timestamp(namespace) for namespace in namespaces]
+                        + [t for t in timestamps if t is not None])
+    return Validators(etag, last_modified)
+
+
+def conditional_view(compute_validators):
+    """
+    Like django.views.decorators.http.condition, but `compute_validators`
+    (request, *args, **kwargs) -> Validators or None runs only once per request.
+    Async views are supported, their validators are computed in a thread.
+    """
+    def get_validators(request, *args, **kwargs):
+        if not hasattr(request, '_blog_validators'):
+            request._blog_validators = compute_validators(request, *args, **kwargs)
+        return request._blog_validators
+
+    def etag(request, *args, **kwargs):
+        validators = get_validators(request, *args, **kwargs)
+        return validators.etag if validators else None
+
+    def last_modified(request, *args, **kwargs):
+        validators = get_validators(request, *args, **kwargs)
+        return validators.last_modified if validators else None
+
+    decorate = condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view_func):
+        conditional = decorate(view_func)
+        if not iscoroutinefunction(view_func):
+            return conditional
+
+        # condition() calls etag() and last_modified() synchronously, and
+        # validators may query the database, which the event loop must not do
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            await sync_to_async(get_validators)(request, *args, **kwargs)
+            return await conditional(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def post_list_validators(request, tag_slug=None):
+    # Any change to a published post, a tag or a comment bumps one of these,
+    # so no query is needed
+    return make_validators(['post_list', tag_slug, request.GET.urlencode()],
+                           ['posts', 'tags', 'sidebar'])
+
+
+def post_detail_validators(request, year, month, day, post):
+    # One query for the post, its latest comment change and its comment count
+    row = (Post.published
+           .filter(slug=post, publish__year=year, publish__month=month, publish__day=day)
+           .annotate(last_comment=Max('comments__updated'))
+           .order_by()
+           .values_list('id', 'updated', 'last_comment', 'active_comment_count')[:1])
+    if not row:
+        # let the view answer with its 404
+        return None
+    post_id, updated, last_comment, comment_count = row[0]
+    return make_validators(['post_detail', post_id, updated, last_comment, comment_count],
+                           ['tags', 'sidebar'], timestamps=[updated, last_comment])
+
+
+def feed_validators(request, *args, **kwargs):
+    return make_validators(['feed', request.scheme, request.path], ['posts', 'tags'])
+
+
+def sitemap_validators(request, *args, **kwargs):
+    return make_validators(['sitemap', request.get_full_path()], ['posts'])
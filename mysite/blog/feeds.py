@@ -1,16 +1,41 @@
-import markdown
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords_html
-from django.urls import reverse_lazy
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from taggit.models import Tag
 
+from .cache import cached
+from .conditional import conditional_view, feed_validators
 from .models import Post
 
+# Feeds are invalidated through the "posts" and "tags" cache namespaces,
+# the timeout only bounds the life of feeds nobody polls anymore
+FEED_TIMEOUT = 60 * 60 * 24
+
 
 class LatestPostsFeed(Feed):
     title = 'My blog'
     # reverse_lazy allows you to use a URL reversal before the project’s URL configuration is loaded.
     link = reverse_lazy('blog:post_list')
     description = 'New posts of my blog.'
+    query_budget = 2
+    # Served from the read replica, see mysite.db_routing
+    read_only = True
+
+    # Answer 304 Not Modified to feed readers polling an unchanged feed
+    @method_decorator(conditional_view(feed_validators))
+    def __call__(self, request, *args, **kwargs):
+        # Serve the rendered XML from the cache, it is rebuilt only after a
+        # published post or a tag changed. The links are absolute, so http
+        # and https requests get their own entry.
+        def render():
+            response = super(LatestPostsFeed, self).__call__(request, *args, **kwargs)
+            return response.content, response['Content-Type']
+
+        content, content_type = cached(('posts', 'tags'), f'feed:{request.scheme}:{request.path}',
+                                       render, FEED_TIMEOUT)
+        return HttpResponse(content, content_type=content_type)
 
     def items(self):
         return Post.published.all()[:5]
@@ -19,7 +44,30 @@ class LatestPostsFeed(Feed):
         return item.title
 
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 30)
+        # pre-rendered on save, see Post.render_body()
+        return item.excerpt_html
 
     def item_pubdate(self, item):
         return item.publish
+
+
+class TagPostsFeed(LatestPostsFeed):
+    """
+    Latest posts with a given tag, at /blog/tag/<slug>/feed/
+    """
+    query_budget = 3
+
+    def get_object(self, request, tag_slug):
+        return get_object_or_404(Tag, slug=tag_slug)
+
+    def title(self, tag):
+        return f'My blog: posts tagged "{tag.name}"'
+
+    def link(self, tag):
+        return reverse('blog:post_list_by_tag', args=[tag.slug])
+
+    def description(self, tag):
+        return f'New posts of my blog tagged "{tag.name}".'
+
+    def items(self, tag):
+        return Post.published.filter(tags__in=[tag])[:5]
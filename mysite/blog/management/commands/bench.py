@@ -0,0 +1,117 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from blog.benchmarking import compare_results, named_urls, run_benchmark, seed_corpus, url_requests
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms')
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every named blog and polls URL in-process against a '
+            'seeded throwaway test database, reporting latency percentiles, '
+            'query counts and SQL time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--comments', type=int, default=5,
+                            help='Comments per post.')
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--choices', type=int, default=4,
+                            help='Choices per question.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed of the corpus.')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Measured requests per URL.')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Unmeasured requests per URL before measuring.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request.')
+        parser.add_argument('--only', nargs='+', metavar='URL_NAME',
+                            help='Only benchmark these URL names, e.g. blog:post_list.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='JSON file of a previous run to compare against.')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent slowdown of --metric reported as a regression.')
+        parser.add_argument('--metric', choices=METRICS, default='p95_ms',
+                            help='Latency metric compared with --compare.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            baseline = json.loads(Path(options['compare']).read_text())['results']
+
+        # Never touch the real database or caches: seed a test database and
+        # use private in-memory caches. setup_test_environment() swaps in the
+        # locmem email backend. DEBUG and the debug toolbar middleware (which
+        # looks up a docker host on every request) stay out of the timings.
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                    CACHES={alias: {**config,
+                                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                    'LOCATION': f'bench-{alias}'}
+                            for alias, config in settings.CACHES.items()},
+                    MIDDLEWARE=[middleware for middleware in settings.MIDDLEWARE
+                                if not middleware.startswith('debug_toolbar.')]):
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'created': timezone.now().isoformat(),
+                'options': {key: options[key] for key in (
+                    'posts', 'tags', 'comments', 'questions', 'choices', 'seed',
+                    'iterations', 'warmup', 'cold')},
+                'results': results,
+            }, indent=2))
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['threshold'], options['metric'])
+            for name, description in regressions:
+                self.stdout.write(self.style.ERROR(f'{name}: {description}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["compare"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}.'))
+
+    def run(self, options):
+        self.stdout.write('Seeding the corpus...')
+        corpus = seed_corpus(posts=options['posts'], tags=options['tags'],
+                             comments_per_post=options['comments'],
+                             questions=options['questions'],
+                             choices_per_question=options['choices'],
+                             seed=options['seed'])
+        requests = url_requests(corpus)
+        for name in named_urls():
+            if name not in requests:
+                self.stderr.write(self.style.WARNING(f'No benchmark request for {name}, skipped.'))
+        if options['only']:
+            unknown = set(options['only']) - set(requests)
+            if unknown:
+                raise CommandError(f'Unknown URL names: {", ".join(sorted(unknown))}')
+            requests = {name: requests[name] for name in options['only']}
+
+        return run_benchmark(Client(), requests, iterations=options['iterations'],
+                             warmup=options['warmup'], cold=options['cold'],
+                             staff=corpus.staff)
+
+    def report(self, results):
+        self.stdout.write(f'{"url":<26} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                          f'{"queries":>8} {"sql ms":>8} {"errors":>7}')
+        for name, stats in results.items():
+            self.stdout.write(f'{name:<26} {stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} '
+                              f'{stats["p99_ms"]:>8.2f} {stats["queries"]:>8.1f} '
+                              f'{stats["sql_ms"]:>8.2f} {stats["errors"]:>7}')
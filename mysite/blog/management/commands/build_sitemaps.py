@@ -0,0 +1,115 @@
+import gzip
+import os
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.sitemaps import PostSitemap
+
+URLSET_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+INDEX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+
+class Command(BaseCommand):
+    help = ('Write the sitemap index and post sitemap pages as static files. '
+            'Serve the output directory at the site root so crawlers never '
+            'reach the ORM, e.g. nginx "try_files $uri @django".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.SITEMAP_ROOT,
+                            help='Directory to write the files to (SITEMAP_ROOT).')
+        parser.add_argument('--base-url',
+                            help='Scheme and host of the URLs, defaults to https:// and the current Site.')
+        parser.add_argument('--limit', type=int, default=PostSitemap.limit,
+                            help='URLs per sitemap page (at most 50,000).')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Write .xml.gz sitemap pages.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched per round trip from the server-side cursor.')
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+        base_url = (options['base_url']
+                    or f'https://{Site.objects.get_current().domain}').rstrip('/')
+        limit = min(options['limit'], 50000)
+
+        rows = (Post.published.order_by('publish', 'id')
+                .values_list('slug', 'publish', 'updated')
+                .iterator(chunk_size=options['chunk_size']))
+
+        # Stream rows into pages, only the current page is open
+        pages = []
+        page = None
+        count = 0
+        for slug, publish, updated in rows:
+            if page is None or page.count == limit:
+                if page is not None:
+                    pages.append(page.close())
+                page = SitemapPage(output, f'sitemap-posts-{len(pages) + 1}.xml', options['gzip'])
+            loc = base_url + Post(slug=slug, publish=publish).get_absolute_url()
+            page.write(loc, updated)
+            count += 1
+        if page is not None:
+            pages.append(page.close())
+
+        index_path = output / 'sitemap.xml'
+        tmp_path = index_path.with_name(index_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(INDEX_HEADER)
+            for filename, lastmod in pages:
+                f.write(f'  <sitemap><loc>{escape(f"{base_url}/{filename}")}</loc>'
+                        f'<lastmod>{lastmod.isoformat()}</lastmod></sitemap>\n')
+            f.write('</sitemapindex>\n')
+        os.replace(tmp_path, index_path)
+
+        # Drop pages left over from a larger or differently compressed build
+        current = {filename for filename, _ in pages}
+        for path in output.glob('sitemap-posts-*.xml*'):
+            if path.name not in current:
+                path.unlink()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} URLs in {len(pages)} sitemap pages to {output}.'))
+
+
+class SitemapPage:
+    """
+    One sitemap file, written to a temporary name and moved into place on
+    close() so the web server never serves a partial file.
+    """
+
+    def __init__(self, directory, filename, compress):
+        if compress:
+            filename += '.gz'
+        self.filename = filename
+        self.path = Path(directory) / filename
+        self.tmp_path = self.path.with_name(filename + '.tmp')
+        if compress:
+            self.file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.file.write(URLSET_HEADER)
+        self.count = 0
+        self.lastmod = None
+
+    def write(self, loc, lastmod):
+        self.file.write(f'  <url><loc>{escape(loc)}</loc>'
+                        f'<lastmod>{lastmod.date().isoformat()}</lastmod>'
+                        f'<changefreq>{PostSitemap.changefreq}</changefreq>'
+                        f'<priority>{PostSitemap.priority}</priority></url>\n')
+        self.count += 1
+        if self.lastmod is None or lastmod > self.lastmod:
+            self.lastmod = lastmod
+
+    def close(self):
+        self.file.write('</urlset>\n')
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.filename, self.lastmod
@@ -0,0 +1,301 @@
+import itertools
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from blog.cache import invalidate
+from blog.markup import render_post_body
+from blog.models import POST_SEARCH_VECTOR, Comment, Post, TagCount
+from blog.pagecache import tag_key
+
+User = get_user_model()
+
+
+def parse_front_matter(text):
+    """
+    Split a Markdown file into ({key: value}, body). The front matter is a
+    block of "key: value" lines between two "---" lines, `tags` being a
+    comma separated list, optionally in brackets.
+    """
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != '---':
+        return {}, text
+    meta = {}
+    for index, line in enumerate(lines[1:], start=1):
+        if line.strip() == '---':
+            body = '\n'.join(lines[index + 1:]).strip('\n')
+            break
+        key, sep, value = line.partition(':')
+        if sep:
+            meta[key.strip().lower()] = value.strip().strip('"\'')
+    else:
+        raise ValueError('front matter is not closed by a "---" line')
+    if 'tags' in meta:
+        meta['tags'] = [tag.strip().strip('"\'') for tag in meta['tags'].strip('[]').split(',')
+                        if tag.strip()]
+    return meta, body
+
+
+def parse_date(value, field):
+    if value in (None, ''):
+        return None
+    date = parse_datetime(value) if isinstance(value, str) else None
+    if date is None:
+        raise ValueError(f'invalid {field} date {value!r}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def parse_status(value):
+    if not value:
+        return Post.Status.PUBLISHED
+    for status in Post.Status:
+        if value.upper() in (status.value, status.name) or value.lower() == status.label.lower():
+            return status
+    raise ValueError(f'invalid status {value!r}')
+
+
+class Command(BaseCommand):
+    help = ('Stream posts, tags and comments from a JSONL file or a directory of '
+            'Markdown files with front matter into the blog, in chunks of bulk '
+            'inserts. An interrupted import continues with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source',
+                            help='A .jsonl file with one post per line, or a directory of '
+                                 '.md files with front matter (title, slug, author, '
+                                 'publish, status, tags).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Posts inserted per transaction.')
+        parser.add_argument('--state',
+                            help='File recording the progress, default <source>.import-state.json.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the records already imported according to --state.')
+        parser.add_argument('--default-author', default='admin',
+                            help='Username of posts without an author.')
+        parser.add_argument('--no-render', action='store_true',
+                            help='Leave the HTML empty and render it afterwards in parallel '
+                                 'with `manage.py render_posts`.')
+        parser.add_argument('--skip-similar', action='store_true',
+                            help='Do not rebuild the similar posts after the import.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        source = Path(options['source'])
+        if not source.exists():
+            raise CommandError(f'{source} does not exist.')
+        state_path = Path(options['state'] or f'{source}.import-state.json')
+
+        position = 0
+        if options['resume'] and state_path.exists():
+            position = json.loads(state_path.read_text())['position']
+            self.stdout.write(f'Resuming after {position} records.')
+
+        self.content_type = ContentType.objects.get_for_model(Post)
+        # Usernames and tag names are few compared to posts, remember them
+        # instead of looking them up again in every chunk
+        self.authors = {}
+        self.tags = {}
+        self.touched_tags = set()
+        imported = skipped = comments = 0
+
+        records = self.read(source, position)
+        while True:
+            chunk = list(itertools.islice(records, options['batch_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                chunk_imported, chunk_comments = self.import_chunk(chunk)
+            # With DEBUG on, Django keeps the SQL of every query, including
+            # these multi-megabyte INSERTs
+            reset_queries()
+            imported += chunk_imported
+            skipped += len(chunk) - chunk_imported
+            comments += chunk_comments
+            # Written once the chunk is committed. A crash in between redoes
+            # the chunk, whose posts are then skipped as already imported.
+            position = chunk[-1][0]
+            state_path.write_text(json.dumps({'source': str(source), 'position': position}))
+            self.stdout.write(f'Imported {imported} posts ({position} records read)...')
+
+        # The bulk inserts bypassed the signals maintaining these
+        invalidate('sidebar', 'posts', 'tags', 'list', *map(tag_key, self.touched_tags))
+        if imported and not options['skip_similar']:
+            self.stdout.write('Rebuilding similar posts...')
+            call_command('rebuild_similar_posts', stdout=self.stdout)
+        state_path.unlink(missing_ok=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} posts and {comments} comments, '
+            f'skipped {skipped} already imported posts.'))
+        if options['no_render']:
+            self.stdout.write('Run `manage.py render_posts` to render the imported posts.')
+
+    # Reading
+
+    def read(self, source, position):
+        """
+        Yield (position, record) for every record after `position`, reading
+        one line or file at a time.
+        """
+        if source.is_dir():
+            # Sorted, so positions are stable between runs
+            paths = sorted(source.glob('*.md'))
+            for number, path in enumerate(paths[position:], start=position + 1):
+                try:
+                    meta, body = parse_front_matter(path.read_text())
+                except ValueError as e:
+                    raise CommandError(f'{path}: {e}')
+                yield number, {**meta, 'body': body, '_location': str(path)}
+        else:
+            with source.open() as lines:
+                for number, line in enumerate(lines, start=1):
+                    if number <= position or not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        raise CommandError(f'{source}:{number}: {e}')
+                    yield number, {**record, '_location': f'{source}:{number}'}
+
+    # Writing
+
+    def import_chunk(self, chunk):
+        """
+        Insert the posts of `chunk` with their tags and comments, in a
+        constant number of queries. Return (posts, comments) inserted.
+        """
+        try:
+            rows = [self.build_post(record) for _, record in chunk]
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.resolve_authors({row['author'] for row in rows})
+        rows = self.skip_existing(rows)
+        if not rows:
+            return 0, 0
+        for row in rows:
+            row['post'].author = self.authors[row['author']]
+        self.resolve_tags({name for row in rows for name in row['tags']})
+
+        posts = Post.objects.bulk_create([row['post'] for row in rows])
+        Post.objects.filter(id__in=[post.id for post in posts]).update(
+            search_vector=POST_SEARCH_VECTOR)
+
+        TaggedItem.objects.bulk_create([
+            TaggedItem(content_type=self.content_type, object_id=row['post'].id,
+                       tag=self.tags[name])
+            for row in rows for name in row['tags']])
+        self.touched_tags.update(self.tags[name].slug for row in rows for name in row['tags'])
+        # Posts are new, so each of their tags gains one published post
+        published_tags = Counter(self.tags[name].id for row in rows for name in row['tags']
+                                 if row['post'].status == Post.Status.PUBLISHED)
+        for count in set(published_tags.values()):
+            TagCount.objects.add([tag_id for tag_id, n in published_tags.items() if n == count],
+                                 count)
+
+        comments = []
+        for row in rows:
+            for comment in row['comments']:
+                comment.post = row['post']
+                comments.append(comment)
+        Comment.objects.bulk_create(comments)
+        # created is auto_now_add, which bulk_create overrides, put back the
+        # dates of the archive
+        dated = [comment for comment in comments if comment._imported_created]
+        for comment in dated:
+            comment.created = comment._imported_created
+        Comment.objects.bulk_update(dated, ['created'])
+        return len(posts), len(comments)
+
+    def build_post(self, record):
+        location = record['_location']
+        try:
+            title = record['title']
+            body = record.get('body', '')
+            publish = parse_date(record.get('publish'), 'publish') or timezone.now()
+            comments = [self.build_comment(comment) for comment in record.get('comments', [])]
+            post = Post(title=title,
+                        slug=record.get('slug') or slugify(title)[:250],
+                        body=body,
+                        publish=publish,
+                        status=parse_status(record.get('status')),
+                        # maintained by signals on save(), computed here instead
+                        active_comment_count=sum(comment.active for comment in comments))
+        except KeyError as e:
+            raise ValueError(f'{location}: missing {e.args[0]}')
+        except ValueError as e:
+            raise ValueError(f'{location}: {e}')
+        if not self.options['no_render']:
+            post.body_html, post.excerpt_html = render_post_body(body)
+        tags = record.get('tags') or []
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        return {'post': post,
+                'author': record.get('author') or self.options['default_author'],
+                'tags': list(dict.fromkeys(tag.strip() for tag in tags if tag.strip())),
+                'comments': comments}
+
+    def build_comment(self, record):
+        comment = Comment(name=record['name'], email=record['email'], body=record['body'],
+                          active=record.get('active', True))
+        comment._imported_created = parse_date(record.get('created'), 'comment created')
+        return comment
+
+    def resolve_authors(self, usernames):
+        """
+        Fill self.authors for `usernames`, creating the missing users
+        without a usable password.
+        """
+        missing = usernames - self.authors.keys()
+        if not missing:
+            return
+        self.authors.update(User.objects.filter(username__in=missing)
+                            .in_bulk(field_name='username'))
+        new = [User(username=username) for username in missing - self.authors.keys()]
+        for user in new:
+            user.set_unusable_password()
+        for user in User.objects.bulk_create(new):
+            self.authors[user.username] = user
+
+    def resolve_tags(self, names):
+        """
+        Fill self.tags for `names`, creating the missing tags.
+        """
+        missing = names - self.tags.keys()
+        if not missing:
+            return
+        self.tags.update(Tag.objects.filter(name__in=missing).in_bulk(field_name='name'))
+        new = [Tag(name=name, slug=slugify(name)) for name in missing - self.tags.keys()]
+        Tag.objects.bulk_create(new, ignore_conflicts=True)
+        self.tags.update(Tag.objects.filter(name__in=missing).in_bulk(field_name='name'))
+        # Tags whose slug clashed with an existing tag, Tag.save() picks a free slug
+        for name in missing - self.tags.keys():
+            self.tags[name] = Tag.objects.create(name=name)
+
+    def skip_existing(self, rows):
+        """
+        Drop rows whose slug is already used by a post of the same publish
+        date, in the database or earlier in the chunk.
+        """
+        existing = {(slug, timezone.localdate(publish)) for slug, publish in
+                    Post.objects.filter(slug__in={row['post'].slug for row in rows})
+                    .values_list('slug', 'publish')}
+        kept = []
+        for row in rows:
+            key = (row['post'].slug, timezone.localdate(row['post'].publish))
+            if key not in existing:
+                existing.add(key)
+                kept.append(row)
+        return kept
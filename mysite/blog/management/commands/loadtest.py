@@ -0,0 +1,434 @@
+import http.client
+import importlib.util
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.test import override_settings
+from django.urls import reverse
+
+from blog.benchmarking import WORDS, seed_corpus, summarize
+from blog.models import Post
+from polls.models import Choice
+
+DEFAULT_MIX = ('blog:post_list=40,blog:post_detail=35,blog:post_search=10,'
+               'blog:post_comment=5,polls:vote=10')
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def parse_mix(mix, routes):
+    """
+    Parse "name=weight,name=weight" into {name: weight}, checking every name
+    is one of `routes`.
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.strip().rpartition('=')
+        if name not in routes:
+            raise CommandError(f'Unknown route {name!r}, choose from {", ".join(routes)}.')
+        weights[name] = float(weight)
+    return weights
+
+
+def histogram(timings_ms):
+    """
+    Count `timings_ms` into HISTOGRAM_MS buckets, {"<=N": count, ">max": count}.
+    """
+    counts = Counter()
+    for timing in timings_ms:
+        for bound in HISTOGRAM_MS:
+            if timing <= bound:
+                counts[f'<={bound}'] += 1
+                break
+        else:
+            counts[f'>{HISTOGRAM_MS[-1]}'] += 1
+    labels = [f'<={bound}' for bound in HISTOGRAM_MS] + [f'>{HISTOGRAM_MS[-1]}']
+    return {label: counts[label] for label in labels}
+
+
+def compare_servers(wsgi, asgi):
+    """
+    Compare the throughput and p95 latency of two runs, overall ("all") and
+    per route: {route: {"wsgi_throughput", "asgi_throughput", "throughput_ratio",
+    "wsgi_p95_ms", "asgi_p95_ms"}}.
+    """
+    rows = {'all': (wsgi, asgi)}
+    rows.update((name, (wsgi['routes'][name], asgi['routes'][name]))
+                for name in wsgi['routes'] if name in asgi['routes'])
+    comparison = {}
+    for name, (wsgi_row, asgi_row) in rows.items():
+        comparison[name] = {
+            'wsgi_throughput': wsgi_row['throughput'],
+            'asgi_throughput': asgi_row['throughput'],
+            'throughput_ratio': (asgi_row['throughput'] / wsgi_row['throughput']
+                                 if wsgi_row['throughput'] else 0),
+            'wsgi_p95_ms': wsgi_row.get('p95_ms', 0),
+            'asgi_p95_ms': asgi_row.get('p95_ms', 0),
+        }
+    return comparison
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_wsgi(sock, host, port):
+    """
+    Worker process: serve the project with wsgiref on the listening socket
+    shared by every worker, one request at a time like a sync worker.
+    """
+    server = WSGIServer((host, port), QuietWSGIRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.server_name, server.server_port = host, port
+    server.setup_environ()
+    server.set_app(get_wsgi_application())
+    server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = ('Start the project under a local prefork WSGI server (or uvicorn '
+            'for ASGI) with N workers, replay a weighted mix of blog and polls '
+            'routes at a target concurrency and report throughput, latency '
+            'histograms and error rates. --server compare loads both, one '
+            'after the other, and compares them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi', 'compare'), default='wsgi',
+                            help='wsgi: forked wsgiref workers and the sync views. asgi: uvicorn '
+                                 '(must be installed) and the async blog views. compare: both.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Server worker processes.')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Concurrent client connections.')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds of measured load.')
+        parser.add_argument('--warmup', type=float, default=3,
+                            help='Seconds of unmeasured load before measuring.')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Weighted routes, default "{DEFAULT_MIX}".')
+        parser.add_argument('--url',
+                            help='Load an already running server at this base URL instead '
+                                 'of starting one. Its database must be the configured one.')
+        parser.add_argument('--posts', type=int, default=500,
+                            help='Posts in the seeded corpus.')
+        parser.add_argument('--questions', type=int, default=50,
+                            help='Questions in the seeded corpus.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.weights = parse_mix(options['mix'], self.route_names())
+        servers = ['wsgi', 'asgi'] if options['server'] == 'compare' else [options['server']]
+
+        if options['url']:
+            if options['server'] == 'compare':
+                raise CommandError('--server compare starts its own servers, drop --url.')
+            url = urlsplit(options['url'])
+            self.prefix = url.path.rstrip('/')
+            results = {options['server']: self.run(url.hostname, url.port or 80, options['server'])}
+        else:
+            # The load runs against a seeded throwaway test database
+            self.prefix = ''
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                          serialize=False)
+            try:
+                self.stdout.write('Seeding the corpus...')
+                seed_corpus(posts=options['posts'], questions=options['questions'],
+                            seed=options['seed'])
+                host = '127.0.0.1'
+                if 'locmem' in settings.CACHES['default']['BACKEND'].lower():
+                    self.stderr.write(self.style.WARNING(
+                        'LocMemCache is private to each worker, cache invalidation does not '
+                        'reach the other workers. Configure a shared cache to size a deployment.'))
+                results = {}
+                # Both servers load the same corpus, the second one also sees
+                # the comments and votes posted during the first run
+                for server in servers:
+                    start = self.start_asgi if server == 'asgi' else self.start_wsgi
+                    port, stop = start(host, options['workers'])
+                    try:
+                        results[server] = self.run(host, port, server)
+                    finally:
+                        stop()
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for server, server_results in results.items():
+            if len(results) > 1:
+                self.stdout.write(self.style.MIGRATE_HEADING(server.upper()))
+            self.report(server_results)
+        if len(results) > 1:
+            results['comparison'] = compare_servers(results['wsgi'], results['asgi'])
+            self.report_comparison(results['comparison'])
+        else:
+            results = results[servers[0]]
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    # Servers
+
+    def server_settings(self, host):
+        # Run the app as deployed: no DEBUG and no debug toolbar
+        return {'DEBUG': False, 'ALLOWED_HOSTS': [host],
+                'MIDDLEWARE': [middleware for middleware in settings.MIDDLEWARE
+                               if not middleware.startswith('debug_toolbar.')]}
+
+    def start_wsgi(self, host, workers):
+        sock = socket.create_server((host, 0), backlog=1024)
+        port = sock.getsockname()[1]
+        # Children must not share the parent's database connection
+        connections.close_all()
+        pids = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    override_settings(**self.server_settings(host)).enable()
+                    serve_wsgi(sock, host, port)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        sock.close()
+        self.stdout.write(f'Started {workers} WSGI workers on {host}:{port}')
+
+        def stop():
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+            for pid in pids:
+                os.waitpid(pid, 0)
+        return port, stop
+
+    def start_asgi(self, host, workers):
+        if importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('--server asgi needs uvicorn, pip install uvicorn.')
+        with socket.create_server((host, 0)) as probe:
+            port = probe.getsockname()[1]
+        server = self.server_settings(host)
+        # The async views are opt-in, and need persistent connections
+        env = {'DB_CONN_MAX_AGE': '60', **os.environ,
+               'DB_NAME': settings.DATABASES['default']['NAME'],
+               'DEBUG': str(server['DEBUG']), 'ALLOWED_HOSTS': host, 'BLOG_ASYNC_VIEWS': 'True'}
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'mysite.asgi:application',
+             '--host', host, '--port', str(port), '--workers', str(workers),
+             '--no-access-log', '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env)
+
+        def stop():
+            process.terminate()
+            process.wait()
+
+        try:
+            self.wait_for_server(host, port)
+        except Exception:
+            stop()
+            raise
+        self.stdout.write(f'Started uvicorn with {workers} workers on {host}:{port}')
+        return port, stop
+
+    def wait_for_server(self, host, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f'The server did not start listening on {host}:{port}.')
+
+    # Routes
+
+    def route_names(self):
+        return ('blog:post_list', 'blog:post_detail', 'blog:post_search',
+                'blog:post_comment', 'polls:vote')
+
+    def build_routes(self):
+        """
+        Return {route name: function(rng) -> (method, path, form data)}.
+        """
+        posts = list(Post.published.only('id', 'slug', 'publish')[:500])
+        choices = list(Choice.objects.values_list('question_id', 'id')[:500])
+        if not posts or not choices:
+            raise CommandError('The load test needs published posts and poll choices.')
+        comment = {'name': 'Load test', 'email': 'load@example.com', 'body': 'Load test comment.'}
+
+        def vote(rng):
+            question_id, choice_id = rng.choice(choices)
+            return 'POST', reverse('polls:vote', args=[question_id]), {'choice': choice_id}
+
+        return {
+            'blog:post_list': lambda rng: ('GET', reverse('blog:post_list'), None),
+            'blog:post_detail': lambda rng: ('GET', rng.choice(posts).get_absolute_url(), None),
+            'blog:post_search': lambda rng: ('GET', reverse('blog:post_search'),
+                                             {'query': rng.choice(WORDS)}),
+            'blog:post_comment': lambda rng: ('POST', reverse('blog:post_comment',
+                                                              args=[rng.choice(posts).id]), comment),
+            'polls:vote': vote,
+        }
+
+    # Load
+
+    def run(self, host, port, server):
+        self.server = server
+        routes = self.build_routes()
+        names = list(self.weights)
+        weights = [self.weights[name] for name in names]
+        csrf_page = self.prefix + Post.published.first().get_absolute_url()
+        options = self.options
+        samples = []
+        lock = threading.Lock()
+        measure_from = time.monotonic() + options['warmup']
+        deadline = measure_from + options['duration']
+
+        def client(index):
+            rng = random.Random(options['seed'] + index)
+            cookie, token = self.fetch_csrf(host, port, csrf_page)
+            own = []
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, data = routes[name](rng)
+                started = time.monotonic()
+                status = self.send(host, port, method, self.prefix + path, data, cookie, token)
+                if started >= measure_from:
+                    own.append((name, status, (time.monotonic() - started) * 1000))
+            with lock:
+                samples.extend(own)
+
+        self.stdout.write(f'{options["concurrency"]} clients for {options["warmup"]:g}s warmup '
+                          f'+ {options["duration"]:g}s...')
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.summarize(samples)
+
+    def fetch_csrf(self, host, port, path):
+        """
+        Return the CSRF cookie and form token a visitor gets from a post page.
+        """
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body = response.read().decode()
+            cookies = response.msg.get_all('Set-Cookie') or []
+        finally:
+            conn.close()
+        cookie = '; '.join(header.split(';', 1)[0] for header in cookies)
+        match = CSRF_INPUT.search(body)
+        return cookie, match.group(1) if match else ''
+
+    def send(self, host, port, method, path, data, cookie, token):
+        """
+        Send one request on a new connection, return its status or the name
+        of the exception it failed with.
+        """
+        headers = {'Cookie': cookie}
+        body = None
+        if method == 'POST':
+            body = urlencode({**data, 'csrfmiddlewaretoken': token})
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif data:
+            path = f'{path}?{urlencode(data)}'
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException) as e:
+            return type(e).__name__
+        finally:
+            conn.close()
+
+    # Results
+
+    def summarize(self, samples):
+        duration = self.options['duration']
+        routes = {}
+        for name in self.weights:
+            route_samples = [sample for sample in samples if sample[0] == name]
+            if not route_samples:
+                continue
+            statuses = Counter(str(status) for _, status, _ in route_samples)
+            errors = sum(count for status, count in statuses.items()
+                         if not status.isdigit() or int(status) >= 400)
+            timings = [timing for _, _, timing in route_samples]
+            routes[name] = {
+                'requests': len(route_samples),
+                'throughput': len(route_samples) / duration,
+                'errors': errors,
+                'error_rate': errors / len(route_samples),
+                'statuses': dict(statuses),
+                **summarize(timings),
+                'histogram': histogram(timings),
+            }
+        errors = sum(route['errors'] for route in routes.values())
+        return {
+            'options': {**{key: self.options[key] for key in (
+                'workers', 'concurrency', 'duration', 'warmup', 'mix', 'url')},
+                'server': self.server},
+            'requests': len(samples),
+            'throughput': len(samples) / duration,
+            'errors': errors,
+            'error_rate': errors / len(samples) if samples else 0,
+            **(summarize([timing for _, _, timing in samples]) if samples else {}),
+            'histogram': histogram([timing for _, _, timing in samples]),
+            'routes': routes,
+        }
+
+    def report(self, results):
+        if not results['requests']:
+            raise CommandError('No request completed during the measured period.')
+        self.stdout.write(
+            f'{results["requests"]} requests, {results["throughput"]:.1f} req/s, '
+            f'{results["error_rate"]:.2%} errors, p50 {results["p50_ms"]:.1f} ms, '
+            f'p95 {results["p95_ms"]:.1f} ms, p99 {results["p99_ms"]:.1f} ms')
+        self.stdout.write(f'{"route":<20} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+                          f'{"p99 ms":>8} {"max ms":>8} {"errors":>7}')
+        for name, route in results['routes'].items():
+            self.stdout.write(f'{name:<20} {route["throughput"]:>8.1f} {route["p50_ms"]:>8.1f} '
+                              f'{route["p95_ms"]:>8.1f} {route["p99_ms"]:>8.1f} '
+                              f'{route["max_ms"]:>8.1f} {route["error_rate"]:>7.1%}')
+            unexpected = {status: count for status, count in route['statuses'].items()
+                          if status not in ('200', '302')}
+            if unexpected:
+                self.stdout.write(self.style.WARNING(f'  statuses: {unexpected}'))
+
+        self.stdout.write('Latency histogram (ms):')
+        peak = max(results['histogram'].values())
+        for label, count in results['histogram'].items():
+            bar = '#' * round(40 * count / peak) if peak else ''
+            self.stdout.write(f'{label:>7} {count:>8} {bar}')
+
+    def report_comparison(self, comparison):
+        self.stdout.write(self.style.MIGRATE_HEADING('ASGI compared to WSGI'))
+        self.stdout.write(f'{"route":<20} {"wsgi req/s":>11} {"asgi req/s":>11} {"ratio":>7} '
+                          f'{"wsgi p95":>9} {"asgi p95":>9}')
+        for name, row in comparison.items():
+            self.stdout.write(f'{name:<20} {row["wsgi_throughput"]:>11.1f} '
+                              f'{row["asgi_throughput"]:>11.1f} {row["throughput_ratio"]:>6.2f}x '
+                              f'{row["wsgi_p95_ms"]:>9.1f} {row["asgi_p95_ms"]:>9.1f}')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post, SimilarPost
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed similar posts of every published post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts rebuilt per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Rows of drafts and deleted posts are not revisited by the batches below
+        SimilarPost.objects.exclude(post__status=Post.Status.PUBLISHED).delete()
+
+        posts = rows = 0
+        last_id = 0
+        while True:
+            ids = list(Post.published.filter(id__gt=last_id)
+                       .order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                rows += SimilarPost.objects.rebuild(ids)
+            posts += len(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Rebuilt {posts} posts...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt similar posts of {posts} posts ({rows} links).'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.cache import invalidate
+from blog.models import TagCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the published posts of every tag, for the tag directory and tag cloud.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tags = TagCount.objects.rebuild()
+        invalidate('tags')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the post counts of {tags} tags.'))
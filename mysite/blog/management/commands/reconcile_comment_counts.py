@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from blog.models import Post, active_comments_count
+
+
+class Command(BaseCommand):
+    help = 'Repair Post.active_comment_count where it drifted from the active comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of posts checked per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(Post.objects.filter(id__gt=last_id)
+                       .order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # Only rewrite the rows whose counter is wrong
+            drifted = list(Post.objects.filter(id__in=ids)
+                           .annotate(actual=active_comments_count())
+                           .exclude(active_comment_count=F('actual'))
+                           .values_list('id', flat=True))
+            if drifted:
+                repaired += Post.objects.filter(id__in=drifted).update_comment_counts()
+            checked += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} posts, repaired {repaired}.'))
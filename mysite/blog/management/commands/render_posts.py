@@ -0,0 +1,67 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from blog.markup import render_post_body
+from blog.models import Post
+
+
+def render_batch(rows):
+    # Runs in a worker process: pure Markdown rendering, no database access
+    return [(pk, *render_post_body(body)) for pk, body in rows]
+
+
+class Command(BaseCommand):
+    help = 'Backfill the pre-rendered HTML body and excerpt of blog posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts rendered and updated per batch.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of rendering processes.')
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every post, not only the ones never rendered.')
+
+    def batches(self, posts, batch_size):
+        # Seek on the primary key so memory stays bounded by the batch size
+        last_id = 0
+        while True:
+            rows = list(posts.filter(id__gt=last_id)
+                        .order_by('id')
+                        .values_list('id', 'body')[:batch_size])
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    def save_batch(self, batch):
+        Post.objects.bulk_update(
+            [Post(id=pk, body_html=html, excerpt_html=excerpt)
+             for pk, html, excerpt in batch],
+            ['body_html', 'excerpt_html'],
+        )
+        self.rendered += len(batch)
+        self.stdout.write(f'Rendered {self.rendered} posts...')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if not options['all']:
+            posts = posts.filter(body_html='')
+
+        self.rendered = 0
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Markdown is CPU bound, so batches are rendered in parallel while
+            # this process writes finished ones back. At most two batches per
+            # worker are in flight, keeping memory constant.
+            in_flight = deque()
+            for rows in self.batches(posts, options['batch_size']):
+                in_flight.append(executor.submit(render_batch, rows))
+                if len(in_flight) >= workers * 2:
+                    self.save_batch(in_flight.popleft().result())
+            while in_flight:
+                self.save_batch(in_flight.popleft().result())
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered {self.rendered} posts.'))
@@ -0,0 +1,109 @@
+import datetime
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails in batches over a single reused SMTP connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of emails locked and sent per batch.')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Attempts before an email is marked as failed.')
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Seconds before the first retry, doubled on every attempt.')
+        parser.add_argument('--lease', type=int, default=600,
+                            help='Seconds a claimed batch is reserved for this worker, '
+                                 'longer than sending a batch takes.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of exiting once it is drained.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep between polls with --loop.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        # One connection for the whole run, opened lazily by the first batch
+        connection = get_connection()
+        sent = failed = 0
+        try:
+            while True:
+                batch_sent, batch_failed, processed = self.send_batch(connection)
+                sent += batch_sent
+                failed += batch_failed
+                if processed:
+                    continue
+                if not options['loop']:
+                    break
+                # Do not hold an idle SMTP connection between polls
+                connection.close()
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} attempts failed.'))
+
+    def claim_batch(self):
+        """
+        Lease a batch of due emails to this worker: their next attempt is
+        pushed past the lease, so other workers skip them until it expires.
+        The transaction only lasts for the SELECT and UPDATE, no SMTP
+        traffic happens while the rows are locked.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # SKIP LOCKED lets several workers drain the outbox side by side
+            emails = list(OutgoingEmail.objects
+                          .select_for_update(skip_locked=True)
+                          .filter(status=OutgoingEmail.Status.PENDING, next_attempt__lte=now)
+                          .order_by('next_attempt')[:self.options['batch_size']])
+            for email in emails:
+                # Counted when claimed, so a worker dying mid-send still uses up an attempt
+                email.attempts += 1
+                email.next_attempt = now + datetime.timedelta(seconds=self.options['lease'])
+            OutgoingEmail.objects.bulk_update(emails, ['attempts', 'next_attempt'])
+        return emails
+
+    def send_batch(self, connection):
+        emails = self.claim_batch()
+        sent = failed = 0
+        for email in emails:
+            message = EmailMessage(subject=email.subject, body=email.message,
+                                   from_email=email.from_email or None,
+                                   to=email.recipients, connection=connection)
+            try:
+                # No-op while the connection is open. Opening it ourselves also
+                # stops send_messages() from closing it after each message.
+                connection.open()
+                connection.send_messages([message])
+            except Exception as e:
+                failed += 1
+                self.schedule_retry(email, e)
+                # the connection may be broken, reopen it for the next message
+                connection.close()
+            else:
+                sent += 1
+                email.status = OutgoingEmail.Status.SENT
+                email.sent = timezone.now()
+                email.last_error = ''
+            # Recorded right away, so a crash later in the batch does not
+            # send this email again. Skipped if the lease expired and another
+            # worker claimed the email since.
+            OutgoingEmail.objects.filter(pk=email.pk, attempts=email.attempts).update(
+                status=email.status, next_attempt=email.next_attempt,
+                last_error=email.last_error, sent=email.sent)
+        return sent, failed, len(emails)
+
+    def schedule_retry(self, email, error):
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= self.options['max_attempts']:
+            email.status = OutgoingEmail.Status.FAILED
+            return
+        delay = self.options['backoff'] * 2 ** (email.attempts - 1)
+        email.next_attempt = timezone.now() + datetime.timedelta(seconds=delay)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import POST_SEARCH_VECTOR, Post
+
+
+class Command(BaseCommand):
+    help = 'Backfill the stored full-text search vector of blog posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts updated per query.')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every post, not only the ones without a vector.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.all()
+        if not options['all']:
+            posts = posts.filter(search_vector__isnull=True)
+
+        # Walk the primary key in ranges so each UPDATE stays short and
+        # locks only one batch of rows at a time
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(posts.filter(id__gt=last_id)
+                       .order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            updated += Post.objects.filter(id__in=ids).update(
+                search_vector=POST_SEARCH_VECTOR)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} posts.'))
@@ -0,0 +1,21 @@
+import markdown
+from django.template.defaultfilters import truncatewords_html
+
+# Number of words kept in Post.excerpt_html, used by list pages and feeds
+EXCERPT_WORDS = 30
+
+
+def render_markdown(text):
+    return markdown.markdown(text)
+
+
+def render_excerpt(html, words=EXCERPT_WORDS):
+    return truncatewords_html(html, words)
+
+
+def render_post_body(body):
+    """
+    Return the (body_html, excerpt_html) pair stored on Post for `body`.
+    """
+    html = render_markdown(body)
+    return html, render_excerpt(html)
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.14 on 2026-10-18 16:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_post_active_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_tag_count', models.PositiveIntegerField()),
+                ('similar_publish', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='blog.post')),
+                ('similar_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['post', '-shared_tag_count', '-similar_publish'], name='blog_similarpost_top_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarpost',
+            constraint=models.UniqueConstraint(fields=('post', 'similar_post'), name='blog_similarpost_unique_pair'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:24
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_comment_search_indexes'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Upper('title'), 'C'), condition=models.Q(('status', 'PB')), name='blog_post_title_prefix_idx'),
+        ),
+    ]
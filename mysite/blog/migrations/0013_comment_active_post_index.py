@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_post_title_prefix_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('active', True)), fields=['post', 'created', 'id'], name='blog_comment_active_post_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_comment_active_post_index'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tag_count', serialize=False, to='taggit.tag')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-post_count', 'tag'], name='blog_tagcount_top_idx')],
+            },
+        ),
+    ]
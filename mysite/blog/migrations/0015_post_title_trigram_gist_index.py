@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:54
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_tagcount'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GistIndex(condition=models.Q(('status', 'PB')), fields=['title'], name='blog_post_title_trgm_gist_idx', opclasses=['gist_trgm_ops']),
+        ),
+    ]
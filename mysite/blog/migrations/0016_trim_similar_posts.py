@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:57
+
+from django.db import migrations
+
+# Only the top 4 (blog.models.SIMILAR_POSTS_KEPT) similar posts of each post
+# are kept from now on, drop the links ranked below them
+TRIM_SQL = """
+    DELETE FROM blog_similarpost WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY post_id
+                ORDER BY shared_tag_count DESC, similar_publish DESC, similar_post_id DESC
+            ) AS rank
+            FROM blog_similarpost
+        ) ranked
+        WHERE rank > 4
+    )
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_title_trigram_gist_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(TRIM_SQL, migrations.RunSQL.noop),
+    ]
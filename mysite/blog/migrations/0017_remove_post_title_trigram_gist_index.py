@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_trim_similar_posts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='blog_post_title_trgm_gist_idx',
+        ),
+    ]
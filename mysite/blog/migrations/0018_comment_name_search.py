@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_remove_post_title_trigram_gist_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='blog_comment_body_search_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', 'body', config='english'), name='blog_comment_search_idx'),
+        ),
+    ]
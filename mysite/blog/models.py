@@ -1,19 +1,92 @@
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Collate, Greatest, Upper
 from django.urls import reverse
 from django.utils import timezone
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
+
+from .markup import render_post_body
+
+
+# Weighted document used by full-text search, title matches (A) outrank body matches (B)
+POST_SEARCH_VECTOR = SearchVector('title', weight='A') + SearchVector('body', weight='B')
+
+# Comment names and bodies are searched (in the admin) through an expression
+# index, the config is explicit because only to_tsvector(config, text) can be
+# indexed
+COMMENT_SEARCH_VECTOR = SearchVector('name', 'body', config='english')
+
+
+def active_comments_count():
+    """
+    Subquery counting the active comments of the outer post.
+    """
+    return Coalesce(Subquery(Comment.objects
+                             .filter(post=OuterRef('pk'), active=True)
+                             .order_by()
+                             .values('post')
+                             .annotate(total=Count('pk'))
+                             .values('total')), 0)
+
+
+class PostQuerySet(models.QuerySet):
+    def update_comment_counts(self):
+        """
+        Recompute active_comment_count of the posts in this queryset from
+        their active comments, in a single UPDATE.
+        """
+        return self.update(active_comment_count=active_comments_count())
 
 
 # Custom model manager to filter published posts
-class PublishedManager(models.Manager):
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return (
             super().get_queryset().filter(status=Post.Status.PUBLISHED)
         )
 
 
-class Post(models.Model):
+class ChangeTrackingModel(models.Model):
+    """
+    Remembers the values loaded from the database, so saves and signal
+    handlers can tell which fields changed.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, field_name, default=None):
+        loaded_values = getattr(self, '_loaded_values', None) or {}
+        return loaded_values.get(field_name, default)
+
+    def has_changed(self, field_name):
+        if getattr(self, '_loaded_values', None) is None:
+            # not loaded from the database, everything is new
+            return True
+        if field_name in self.get_deferred_fields():
+            return False
+        return self._loaded_values.get(field_name) != getattr(self, field_name)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        deferred_fields = self.get_deferred_fields()
+        self._loaded_values = {f.attname: getattr(self, f.attname)
+                               for f in self._meta.concrete_fields
+                               if f.attname not in deferred_fields}
+
+
+class Post(ChangeTrackingModel):
     # Enum class
     class Status(models.TextChoices):
         # name = value, label
@@ -30,6 +103,9 @@ class Post(models.Model):
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="blog_posts")
     body = models.TextField()
+    # Markdown of body rendered on save, so requests never run Markdown
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     # auto_now_add - time will be saved when created
     created = models.DateTimeField(auto_now_add=True)
@@ -37,9 +113,15 @@ class Post(models.Model):
     updated = models.DateTimeField(auto_now=True)
     status = models.CharField(
         max_length=2, choices=Status, default=Status.DRAFT)
+    # stored tsvector of POST_SEARCH_VECTOR, kept current by blog.signals
+    # and backfilled with `manage.py update_search_vectors`
+    search_vector = SearchVectorField(null=True, editable=False)
+    # number of active comments, maintained with F() updates by blog.signals
+    # and repaired with `manage.py reconcile_comment_counts`
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False)
 
     # The default model manager
-    objects = models.Manager()
+    objects = PostQuerySet.as_manager()
     # Use our custom manager
     published = PublishedManager()
     # Taggit
@@ -52,12 +134,47 @@ class Post(models.Model):
         # add index to publish col in -publish Desc order
         # Index ordering is not supported on MySQL. If you use MySQL for the database, a descending index will be created as a normal index.
         indexes = [
-            models.Index(fields=['-publish'])
+            models.Index(fields=['-publish']),
+            # full-text search on the stored vector
+            GinIndex(fields=['search_vector'],
+                     name='blog_post_search_vector_idx'),
+            # trigram index for similarity lookups on title (pg_trgm)
+            GinIndex(fields=['title'], name='blog_post_title_trgm_idx',
+                     opclasses=['gin_trgm_ops']),
+            # top-N "most commented" reads
+            models.Index(fields=['status', '-active_comment_count'],
+                         name='blog_post_most_commented_idx'),
+            # title prefixes of published posts, for the search autocomplete
+            # (see blog.search.autocomplete). With the "C" collation the same
+            # index serves LIKE 'PREFIX%' and the ORDER BY of the top N.
+            models.Index(Collate(Upper('title'), 'C'), condition=Q(status='PB'),
+                         name='blog_post_title_prefix_idx'),
         ]
 
     def __str__(self):
         return self.title
 
+    def render_body(self):
+        self.body_html, self.excerpt_html = render_post_body(self.body)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # The comment counter is only ever changed with F() updates,
+            # never write back the possibly stale in-memory value
+            deferred_fields = self.get_deferred_fields()
+            update_fields = [f.name for f in self._meta.concrete_fields
+                             if not f.primary_key
+                             and f.name != 'active_comment_count'
+                             and f.attname not in deferred_fields]
+            kwargs['update_fields'] = update_fields
+        # only pay for Markdown when the body was edited
+        if self.has_changed('body') and (update_fields is None or 'body' in update_fields):
+            self.render_body()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'body_html', 'excerpt_html'}
+        super().save(*args, **kwargs)
+
     # use Canonical URL
     def get_absolute_url(self):
         return reverse('blog:post_detail', args=[
@@ -68,7 +185,7 @@ class Post(models.Model):
         ])
 
 
-class Comment(models.Model):
+class Comment(ChangeTrackingModel):
     post = models.ForeignKey(
         Post, on_delete=models.CASCADE, related_name='comments')
     name = models.CharField(max_length=80)
@@ -82,7 +199,321 @@ class Comment(models.Model):
         ordering = ['created']
         indexes = [
             models.Index(fields=['created']),
+            # the active comments of a post in (created, id) order, read a
+            # page at a time by post_detail and post_comments
+            models.Index(fields=['post', 'created', 'id'], condition=Q(active=True),
+                         name='blog_comment_active_post_idx'),
+            models.Index(fields=['email']),
+            GinIndex(COMMENT_SEARCH_VECTOR, name='blog_comment_search_idx'),
         ]
 
     def __str__(self):
         return f'Comment by {self.name} on {self.post}'
+
+
+# Similar posts kept per post, as many as post_detail shows. Storing every
+# pair of posts sharing a tag would grow with the square of a tag's posts.
+SIMILAR_POSTS_KEPT = 4
+
+
+class SimilarPostManager(models.Manager):
+    # Rank of a similar post, the order post_detail lists them in
+    RANKING = 'shared_tag_count DESC, similar_publish DESC, similar_post_id DESC'
+
+    def top_lists(self, post_ids):
+        """
+        Return {post id: [similar post ids, best first]} for `post_ids`.
+        """
+        lists = {post_id: [] for post_id in post_ids}
+        for post_id, similar_post_id in (self.filter(post_id__in=lists)
+                                         .order_by('post_id', '-shared_tag_count',
+                                                   '-similar_publish', '-similar_post_id')
+                                         .values_list('post_id', 'similar_post_id')):
+            lists[post_id].append(similar_post_id)
+        return lists
+
+    def refresh_for(self, post):
+        """
+        Update the similar posts of `post`, and its place in the similar
+        posts of others, after its tags, status or publish date changed.
+        Return the ids of the other posts whose similar posts changed.
+
+        Only the posts that listed `post`, and those it now enters the top
+        SIMILAR_POSTS_KEPT of, are touched.
+        """
+        with transaction.atomic():
+            listing = list(self.filter(similar_post=post).values_list('post_id', flat=True))
+            before = self.top_lists(listing)
+            self.filter(models.Q(post=post) | models.Q(similar_post=post)).delete()
+            # Recomputed from scratch, which puts `post` back where it still ranks
+            self.rebuild([post.id, *listing])
+            after = self.top_lists(listing)
+            changed = {post_id for post_id in listing if before[post_id] != after[post_id]}
+            if post.status == Post.Status.PUBLISHED:
+                changed.update(self.enter(post, exclude=[post.id, *listing]))
+        return sorted(changed)
+
+    def enter(self, post, exclude):
+        """
+        Add `post` to the similar posts of the posts sharing a tag with it
+        whose top SIMILAR_POSTS_KEPT it now belongs to, except those in
+        `exclude`, and drop the links it pushes out. Each candidate costs one
+        probe of blog_similarpost_top_idx. Return the ids of those posts.
+        """
+        table = self.model._meta.db_table
+        content_type = ContentType.objects.get_for_model(Post)
+        sql = f"""
+            INSERT INTO {table} (post_id, similar_post_id, similar_publish, shared_tag_count)
+            SELECT shared.other_id, %(post)s, %(publish)s, shared.shared_tag_count
+            FROM (
+                SELECT b.object_id AS other_id, COUNT(*) AS shared_tag_count
+                FROM {TaggedItem._meta.db_table} a
+                JOIN {TaggedItem._meta.db_table} b
+                    ON b.tag_id = a.tag_id
+                    AND b.content_type_id = a.content_type_id
+                    AND b.object_id <> a.object_id
+                JOIN {Post._meta.db_table} other ON other.id = b.object_id
+                WHERE a.content_type_id = %(content_type)s
+                    AND a.object_id = %(post)s
+                    AND other.status = %(published)s
+                    AND NOT b.object_id = ANY(%(exclude)s)
+                GROUP BY b.object_id
+            ) shared
+            LEFT JOIN LATERAL (
+                SELECT last.shared_tag_count, last.similar_publish, last.similar_post_id
+                FROM {table} last
+                WHERE last.post_id = shared.other_id
+                ORDER BY {self.RANKING}
+                OFFSET %(last)s LIMIT 1
+            ) last ON true
+            WHERE last.similar_post_id IS NULL
+                OR (shared.shared_tag_count, %(publish)s, %(post)s)
+                    > (last.shared_tag_count, last.similar_publish, last.similar_post_id)
+            RETURNING post_id
+        """
+        params = {'post': post.id, 'publish': post.publish, 'content_type': content_type.id,
+                  'published': Post.Status.PUBLISHED, 'exclude': list(exclude),
+                  'last': SIMILAR_POSTS_KEPT - 1}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            entered = [row[0] for row in cursor.fetchall()]
+        self.trim(entered)
+        return entered
+
+    def trim(self, post_ids):
+        """
+        Delete the links of `post_ids` beyond their top SIMILAR_POSTS_KEPT.
+        """
+        if not post_ids:
+            return
+        table = self.model._meta.db_table
+        sql = f"""
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY post_id ORDER BY {self.RANKING})
+                        AS rank
+                    FROM {table}
+                    WHERE post_id = ANY(%s)
+                ) ranked
+                WHERE rank > %s
+            )
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [list(post_ids), SIMILAR_POSTS_KEPT])
+
+    def rebuild(self, post_ids):
+        """
+        Recompute the top SIMILAR_POSTS_KEPT similar posts of the posts in
+        `post_ids` with one INSERT ... SELECT self-join of the tagging table.
+        """
+        self.filter(post_id__in=post_ids).delete()
+        content_type = ContentType.objects.get_for_model(Post)
+        sql = f"""
+            INSERT INTO {self.model._meta.db_table}
+                (post_id, similar_post_id, similar_publish, shared_tag_count)
+            SELECT post_id, similar_post_id, similar_publish, shared_tag_count
+            FROM (
+                SELECT a.object_id AS post_id, b.object_id AS similar_post_id,
+                    other.publish AS similar_publish, COUNT(*) AS shared_tag_count,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY a.object_id
+                        ORDER BY COUNT(*) DESC, other.publish DESC, b.object_id DESC
+                    ) AS rank
+                FROM {TaggedItem._meta.db_table} a
+                JOIN {TaggedItem._meta.db_table} b
+                    ON b.tag_id = a.tag_id
+                    AND b.content_type_id = a.content_type_id
+                    AND b.object_id <> a.object_id
+                JOIN {Post._meta.db_table} post ON post.id = a.object_id
+                JOIN {Post._meta.db_table} other ON other.id = b.object_id
+                WHERE a.content_type_id = %s
+                    AND a.object_id = ANY(%s)
+                    AND post.status = %s
+                    AND other.status = %s
+                GROUP BY a.object_id, b.object_id, other.publish
+            ) ranked
+            WHERE rank <= %s
+        """
+        published = Post.Status.PUBLISHED
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [content_type.id, list(post_ids), published, published,
+                                 SIMILAR_POSTS_KEPT])
+            return cursor.rowcount
+
+
+class SimilarPost(models.Model):
+    """
+    One of the top SIMILAR_POSTS_KEPT posts sharing the most tags with a
+    published post, maintained by blog.signals and rebuilt with
+    `manage.py rebuild_similar_posts`.
+    """
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='similar_links')
+    similar_post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name='+')
+    shared_tag_count = models.PositiveIntegerField()
+    # copy of similar_post.publish so the ordering is served by the index
+    similar_publish = models.DateTimeField()
+
+    objects = SimilarPostManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'similar_post'],
+                                    name='blog_similarpost_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['post', '-shared_tag_count', '-similar_publish'],
+                         name='blog_similarpost_top_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar_post_id} is similar to {self.post_id}'
+
+
+class TagCountManager(models.Manager):
+    def add(self, tag_ids, delta):
+        """
+        Add `delta` to the published post count of every tag in `tag_ids`,
+        creating the missing rows.
+        """
+        tag_ids = list(tag_ids)
+        if not tag_ids or not delta:
+            return
+        if delta < 0:
+            # Never below zero, even if the counts drifted
+            self.filter(tag_id__in=tag_ids).update(
+                post_count=Greatest(F('post_count') + delta, 0))
+            return
+        table = self.model._meta.db_table
+        sql = f"""
+            INSERT INTO {table} (tag_id, post_count)
+            SELECT tag_id, %s FROM unnest(%s) AS tag_id
+            ON CONFLICT (tag_id) DO UPDATE
+                SET post_count = {table}.post_count + EXCLUDED.post_count
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [delta, tag_ids])
+
+    def rebuild(self, tag_ids=None):
+        """
+        Recount the published posts of the tags in `tag_ids` (of every tag
+        by default) with one INSERT ... SELECT over the tagging table.
+        Return the number of those tags in use.
+        """
+        content_type = ContentType.objects.get_for_model(Post)
+        params = [content_type.id, Post.Status.PUBLISHED]
+        tag_filter = ''
+        if tag_ids is None:
+            self.all().delete()
+        else:
+            tag_ids = list(tag_ids)
+            self.filter(tag_id__in=tag_ids).delete()
+            tag_filter = 'AND item.tag_id = ANY(%s)'
+            params.append(tag_ids)
+        sql = f"""
+            INSERT INTO {self.model._meta.db_table} (tag_id, post_count)
+            SELECT item.tag_id, COUNT(*)
+            FROM {TaggedItem._meta.db_table} item
+            JOIN {Post._meta.db_table} post ON post.id = item.object_id
+            WHERE item.content_type_id = %s AND post.status = %s {tag_filter}
+            GROUP BY item.tag_id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def top(self, count):
+        """
+        The `count` tags with the most published posts, an index scan on
+        blog_tagcount_top_idx.
+        """
+        return (self.filter(post_count__gt=0)
+                .select_related('tag')
+                .order_by('-post_count', 'tag_id')[:count])
+
+
+class TagCount(models.Model):
+    """
+    Number of published posts of a tag, maintained by blog.signals and
+    rebuilt with `manage.py rebuild_tag_counts`. Counting the tagging table
+    on every request would scan all of it.
+    """
+    tag = models.OneToOneField(
+        Tag, on_delete=models.CASCADE, primary_key=True, related_name='tag_count')
+    post_count = models.PositiveIntegerField(default=0)
+
+    objects = TagCountManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count', 'tag'], name='blog_tagcount_top_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.post_count} posts'
+
+
+class OutgoingEmailManager(models.Manager):
+    def enqueue(self, subject, message, recipient_list, from_email=None):
+        return self.create(subject=subject, message=message,
+                           from_email=from_email or '',
+                           recipients=list(recipient_list))
+
+
+class OutgoingEmail(models.Model):
+    """
+    Outbox of emails sent by views, delivered by `manage.py send_queued_mail`.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PD', 'Pending'
+        SENT = 'ST', 'Sent'
+        FAILED = 'FL', 'Failed'
+
+    subject = models.TextField()
+    message = models.TextField()
+    # empty to use DEFAULT_FROM_EMAIL
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField()
+    status = models.CharField(
+        max_length=2, choices=Status, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # retries are pushed back with an exponential backoff
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    objects = OutgoingEmailManager()
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            # only the pending rows are ever scanned by the worker
+            models.Index(fields=['next_attempt'],
+                         condition=models.Q(status='PD'),
+                         name='blog_outgoingemail_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.recipients)}'
@@ -0,0 +1,180 @@
+"""
+Full-page cache for anonymous GET requests, purged with surrogate keys.
+
+Views tag the page they render with the surrogate keys of everything it
+shows, using add_surrogate_keys():
+
+    "list"          the post list (new or re-dated published posts)
+    "post:<id>"     a post shown on the page (its detail page or a list entry)
+    "tag:<slug>"    a tag shown on the page, or the tag of a tag listing
+
+Every surrogate key is a blog.cache namespace. A page is stored with the
+versions its keys had when it was rendered and is served only while none of
+them changed, so blog.signals invalidating "post:12" purges exactly the pages
+showing post 12. The keys are also sent in a Surrogate-Key header for a
+caching proxy in front of the site.
+
+CSRF tokens are per visitor and must never be cached. Templates use
+{% cacheable_csrf_token %}, which renders a placeholder while the page is
+being cached; the placeholder is swapped for the visitor's token every time
+the page is served.
+
+The sidebar of base.html is spliced in the same way ({% sidebar %}). It
+shows the latest and most commented posts, so caching it in the page would
+make every comment purge every page. Its tags read their own "sidebar" cache
+namespace, which costs no query once warm.
+"""
+
+import functools
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.backends.utils import csrf_input
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from mysite.db_routing import read_from_replica
+
+from .cache import changed_recently, get_versions
+
+# Pages are purged through their surrogate keys, the timeout only bounds
+# the life of pages nobody visits anymore
+PAGE_TIMEOUT = 60 * 60
+CSRF_PLACEHOLDER = '<!-- blog:csrf_token -->'
+SIDEBAR_PLACEHOLDER = '<!-- blog:sidebar -->'
+# The query parameters the cached views read, any other (?utm_source=...)
+# is left out of the page key so it can't multiply the entries of a page
+PAGE_PARAMETERS = ('page', 'after', 'before')
+
+
+def post_key(post_id):
+    return f'post:{post_id}'
+
+
+def tag_key(slug):
+    return f'tag:{slug}'
+
+
+def add_surrogate_keys(request, *keys):
+    """
+    Record surrogate keys of the page being rendered for `request`. Does
+    nothing when the page is not being cached.
+    """
+    surrogate_keys = getattr(request, '_surrogate_keys', None)
+    if surrogate_keys is not None:
+        surrogate_keys.update(keys)
+
+
+def is_caching_page(request):
+    return getattr(request, '_surrogate_keys', None) is not None
+
+
+def render_sidebar(request):
+    return render_to_string('blog/sidebar.html', request=request)
+
+
+def _page_key(request):
+    params = urlencode(sorted((name, value) for name, value in request.GET.items()
+                              if name in PAGE_PARAMETERS))
+    url = f'{request.build_absolute_uri(request.path)}?{params}'
+    return f'blog:page:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def _finish(request, response, content, surrogate_keys):
+    """
+    Fill in the visitor's CSRF token, the current sidebar and the
+    Surrogate-Key header.
+    """
+    placeholder = CSRF_PLACEHOLDER.encode()
+    if placeholder in content:
+        content = content.replace(placeholder, csrf_input(request).encode())
+        # the page now holds this visitor's token, shared caches must not keep it
+        patch_cache_control(response, private=True)
+    placeholder = SIDEBAR_PLACEHOLDER.encode()
+    if placeholder in content:
+        content = content.replace(placeholder, render_sidebar(request).encode())
+        # a proxy caching the whole page has to purge it with the sidebar
+        surrogate_keys = {*surrogate_keys, 'sidebar'}
+    response.content = content
+    response['Surrogate-Key'] = ' '.join(sorted(surrogate_keys))
+    return response
+
+
+def _cached_response(request):
+    """
+    Return the cached page of `request` if none of its surrogate keys
+    changed since it was stored, otherwise None.
+    """
+    entry = cache.get(_page_key(request))
+    if entry is not None and get_versions(entry['versions']) == entry['versions']:
+        response = HttpResponse(content_type=entry['content_type'])
+        return _finish(request, response, entry['content'], entry['versions'])
+    return None
+
+
+def _store(request, response, started, rendered):
+    """
+    Cache `response`, rendered between the `started` and `rendered` times,
+    and return it finished for the visitor.
+    """
+    surrogate_keys = request._surrogate_keys
+    del request._surrogate_keys
+
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return _finish(request, response, response.content, surrogate_keys)
+
+    content = response.content
+    versions = get_versions(surrogate_keys)
+    # A key invalidated while the view ran may have been read before the
+    # change, keep that page out of the cache. Versions are invalidation
+    # times, and keys started by get_versions() above are newer than `rendered`.
+    # A page read from the replica right after a change may predate it too.
+    if (not any(started <= version <= rendered for version in versions.values())
+            and not (read_from_replica() and changed_recently(versions.values()))):
+        cache.set(_page_key(request), {'content': content,
+                                       'content_type': response['Content-Type'],
+                                       'versions': versions}, PAGE_TIMEOUT)
+    return _finish(request, response, content, surrogate_keys)
+
+
+def cache_anonymous_page(view_func):
+    """
+    Serve anonymous GETs of `view_func` from the page cache, see the module
+    docstring. Logged-in users and other methods always reach the view.
+    Async views are supported.
+    """
+    if iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or (await request.auser()).is_authenticated:
+                return await view_func(request, *args, **kwargs)
+
+            response = await sync_to_async(_cached_response)(request)
+            if response is not None:
+                return response
+
+            started = time.time_ns()
+            request._surrogate_keys = set()
+            response = await view_func(request, *args, **kwargs)
+            return await sync_to_async(_store)(request, response, started, time.time_ns())
+
+        return async_wrapper
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+
+        response = _cached_response(request)
+        if response is not None:
+            return response
+
+        started = time.time_ns()
+        request._surrogate_keys = set()
+        response = view_func(request, *args, **kwargs)
+        return _store(request, response, started, time.time_ns())
+
+    return wrapper
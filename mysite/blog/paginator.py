@@ -0,0 +1,142 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """
+    One page of a CursorPaginator. Unlike django.core.paginator.Page it has
+    no page number or total count, only cursors to the neighbouring pages.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0])
+        return None
+
+
+class CursorPaginator:
+    """
+    Keyset (seek) pagination over `queryset` ordered by `ordering`.
+
+    Pages are fetched with a WHERE on the ordering columns of the last row seen
+    instead of an OFFSET, and no COUNT(*) is run, so every page costs the same
+    index range scan. All ordering fields must sort in the same direction and
+    the last one must be unique (usually the primary key).
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-publish', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith('-')
+        self.fields = [f.lstrip('-') for f in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = []
+        for name in self.fields:
+            field = obj._meta.get_field(name)
+            values.append(field.value_to_string(obj))
+        data = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise InvalidCursor('Cursor does not match the ordering')
+            model = self.queryset.model
+            values = [model._meta.get_field(name).to_python(value)
+                      for name, value in zip(self.fields, values)]
+        except (TypeError, ValueError, ValidationError) as e:
+            raise InvalidCursor(str(e)) from e
+        # to_python() lets None through, which no seek condition can compare to
+        if None in values:
+            raise InvalidCursor('Cursor contains a null value')
+        return values
+
+    def _seek(self, cursor, forward):
+        """
+        Return the rows following (`forward`) or preceding the position
+        encoded in `cursor`, raising InvalidCursor for a malformed one.
+        """
+        values = self.decode_cursor(cursor)
+        try:
+            return self._seek_values(values, forward)
+        except (TypeError, ValueError, ValidationError) as e:
+            raise InvalidCursor(str(e)) from e
+
+    def _seek_values(self, values, forward):
+        # Lexicographic (a, b) > (x, y) written as a > x OR (a = x AND b > y)
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            equal = {field: value for field, value in zip(self.fields[:i], values[:i])}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+        # Redundant bound on the leading column lets the planner start
+        # the index range scan at the cursor
+        bound = {f'{self.fields[0]}__{lookup}e': values[0]}
+        return self.queryset.filter(**bound).filter(condition)
+
+    def page(self, after=None, before=None):
+        """
+        Return the page following the `after` cursor, or the page preceding
+        the `before` cursor, or the first page if neither is given.
+        """
+        if before:
+            reverse_ordering = [f[1:] if f.startswith('-') else f'-{f}'
+                                for f in self.ordering]
+            queryset = self._seek(before, forward=False)
+            rows = list(queryset.order_by(*reverse_ordering)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, has_next=True, has_previous=has_previous)
+
+        queryset = self.queryset
+        if after:
+            queryset = self._seek(after, forward=True)
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self,
+                          has_next=has_next, has_previous=bool(after))
@@ -0,0 +1,185 @@
+"""
+Post search, paginated and cached.
+
+The ids of the posts matching a query are computed once per normalized query
+("Django  ORM" and "django orm" share an entry) and kept in the "search"
+cache, which drops the least recently used queries beyond its MAX_ENTRIES
+and expires entries after its TIMEOUT (see settings.CACHES). The entries are
+also keyed by the version of the "posts" namespace, so publishing or editing
+a post makes every cached search stale at once.
+
+A page then loads only its own rows, with a highlighted snippet of the body
+(ts_headline, which re-parses the whole body) computed for those rows only.
+
+autocomplete() suggests titles while the visitor types: first the titles
+starting with the typed text, read in order from an index, then titles with
+words resembling it (trigram word similarity) when there are too few.
+"""
+
+import hashlib
+
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    TrigramSimilarity,
+    TrigramWordDistance,
+)
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.paginator import Paginator
+from django.db.models import F, Q
+from django.db.models.functions import Collate, Upper
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .cache import cached
+from .models import Post
+
+RESULTS_PER_PAGE = 10
+# Queries matching more posts only show the best SEARCH_MAX_RESULTS
+SEARCH_MAX_RESULTS = 1000
+# ts_headline markers, replaced by <mark> once the snippet is escaped
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_MAX_LENGTH = 100
+# Fuzzy matches are ranked among at most this many candidates, the newest
+# titles matching, so a word found in many titles stays cheap
+FUZZY_CANDIDATES = 100
+# Hot prefixes are served from the cache, briefly since every keystroke
+# makes a new one
+AUTOCOMPLETE_TIMEOUT = 60
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def query_key(query):
+    # Queries have spaces and any length, which cache keys must not
+    return hashlib.md5(query.encode()).hexdigest()
+
+
+def search_posts(query):
+    """
+    Return the published posts matching `query`, best matches first: posts
+    whose title is similar to it, or whose title or body contains its words.
+    """
+    # Search in title and body columns using SearchVector with stop words based on defined language
+    # search_vector = SearchVector('title', 'body', config='spanish')
+
+    """
+    In the preceding code, we apply different weights to the search vectors built using the title and body fields. The default weights are D, C, B, and A, and they refer to the numbers 0.1, 0.2, 0.4, and 1.0, respectively. We apply a weight of 1.0 to the title search vector (A) and a weight of 0.4 to the body vector (B). Title matches will prevail over body content matches. We filter the results to display only the ones with a rank higher than 0.3.
+    """
+    # The weighted title/body vector is stored on Post.search_vector
+    # (see POST_SEARCH_VECTOR), so it is not rebuilt for every post on each search
+    # search_vector = SearchVector(
+    #     'title', weight='A') + SearchVector('body', weight='B')
+
+    # SearchQuery removes any stop words such as "a", "an", "of"...
+    '''
+    https://github.com/postgres/postgres/blob/master/src/backend/snowball/stopwords/spanish.stop
+    '''
+    # search_query = SearchQuery(query, config='spanish')
+    search_query = SearchQuery(query)
+
+    # Use SearchRank, ranking by number of occurrences of the search term
+    # Both filters are index lookups: @@ on the GIN search_vector index
+    # and % (trigram_similar) on the GIN trigram index of title. % compares
+    # with pg_trgm.similarity_threshold, which the database OPTIONS set to
+    # 0.1 like the former .filter(similarity__gt=0.1), see settings.
+    return (Post.published.annotate(
+        similarity=TrigramSimilarity('title', query),
+        rank=SearchRank(F('search_vector'), search_query)
+    )
+        .filter(Q(search_vector=search_query) |
+                Q(title__trigram_similar=query))
+        # .filter(rank__gte=0.3)
+        .order_by('-rank', '-similarity')
+    )
+
+
+def search_post_ids(query):
+    """
+    Return the ids of the posts matching `query`, best first, from the cache.
+    One id beyond SEARCH_MAX_RESULTS tells whether more posts match.
+    """
+    query = normalize_query(query)
+    return cached('posts', f'search:{query_key(query)}', lambda: list(
+        search_posts(query).values_list('id', flat=True)[:SEARCH_MAX_RESULTS + 1]),
+        timeout=DEFAULT_TIMEOUT, using='search')
+
+
+def highlight(headline):
+    """
+    Escape a ts_headline snippet and turn its markers into <mark> elements.
+    """
+    return mark_safe(escape(headline).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>'))
+
+
+def search_page(query, number):
+    """
+    Return page `number` of the posts matching `query`. Its posts carry a
+    `snippet` of their body with the matched words highlighted, and
+    `page.truncated` is True when more than SEARCH_MAX_RESULTS posts matched.
+    """
+    post_ids = search_post_ids(query)
+    page = Paginator(post_ids[:SEARCH_MAX_RESULTS], RESULTS_PER_PAGE).get_page(number)
+    page.truncated = len(post_ids) > SEARCH_MAX_RESULTS
+    posts = (Post.published.filter(id__in=page.object_list)
+             .annotate(headline=SearchHeadline('body', SearchQuery(normalize_query(query)),
+                                               start_sel=START_SEL, stop_sel=STOP_SEL,
+                                               max_fragments=2))
+             .defer('body', 'body_html', 'search_vector')
+             .in_bulk())
+    # in the order of the cached ranking, posts unpublished since are dropped
+    page.object_list = [posts[post_id] for post_id in page.object_list if post_id in posts]
+    for post in page.object_list:
+        post.snippet = highlight(post.headline)
+    return page
+
+
+def title_prefix_matches(term, limit):
+    # Same expression as the blog_post_title_prefix_idx index
+    return list(Post.published
+                .alias(title_key=Collate(Upper('title'), 'C'))
+                .filter(title_key__startswith=term.upper())
+                .order_by('title_key')
+                .only('id', 'title', 'slug', 'publish')[:limit])
+
+
+def title_fuzzy_matches(term, limit, exclude):
+    # %> on the blog_post_title_trgm_idx index. Only the newest
+    # FUZZY_CANDIDATES matches are ranked, so a word found in many titles
+    # costs a bounded scan and always gives the same suggestions.
+    candidates = (Post.published
+                  .filter(title__trigram_word_similar=term)
+                  .exclude(id__in=exclude)
+                  .order_by('-publish', '-id')
+                  .values('id')[:FUZZY_CANDIDATES])
+    return list(Post.published
+                .filter(id__in=candidates)
+                .order_by(TrigramWordDistance(term, 'title'), '-publish', '-id')
+                .only('id', 'title', 'slug', 'publish')[:limit])
+
+
+def autocomplete(term, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Return up to `limit` published posts whose title starts with `term`
+    (ignoring case), completed with fuzzy matches, as
+    [{"id", "title", "url"}, ...].
+    """
+    term = normalize_query(term)[:AUTOCOMPLETE_MAX_LENGTH]
+    if len(term) < AUTOCOMPLETE_MIN_LENGTH:
+        return []
+
+    def compute():
+        posts = title_prefix_matches(term, limit)
+        if len(posts) < limit:
+            posts += title_fuzzy_matches(term, limit - len(posts), [post.id for post in posts])
+        return [{'id': post.id, 'title': post.title, 'url': post.get_absolute_url()}
+                for post in posts]
+
+    return cached('posts', f'autocomplete:{limit}:{query_key(term)}', compute, AUTOCOMPLETE_TIMEOUT)
@@ -0,0 +1,184 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+
+from .cache import invalidate
+from .models import POST_SEARCH_VECTOR, Comment, Post, SimilarPost, TagCount
+from .pagecache import post_key, tag_key
+
+
+def is_or_was_published(post):
+    """
+    True if `post` is published, or was published before the change being saved.
+    """
+    return Post.Status.PUBLISHED in (post.status, post.loaded_value('status'))
+
+
+@receiver(post_save, sender=Post)
+def update_search_vector(sender, instance, **kwargs):
+    # Skip saves that did not change the indexed columns. Post.save() always
+    # lists title and body in update_fields, so those cannot tell.
+    if not (instance.has_changed('title') or instance.has_changed('body')):
+        return
+    # Computed by Postgres in a single UPDATE, so the text is tokenized once per write
+    Post.objects.filter(pk=instance.pk).update(search_vector=POST_SEARCH_VECTOR)
+
+
+@receiver(post_save, sender=Post)
+def update_similar_posts_on_save(sender, instance, created, **kwargs):
+    # Tags of a new post are added after it is saved, m2m_changed handles them
+    if created:
+        return
+    if instance.has_changed('status') or instance.has_changed('publish'):
+        # purge the pages of the posts that now list this one as similar
+        invalidate(*map(post_key, SimilarPost.objects.refresh_for(instance)))
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def update_similar_posts_on_tagging(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post) or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # taggit sends post_add even when every tag was already there
+    if action != 'post_clear' and not pk_set:
+        return
+    invalidate(*map(post_key, SimilarPost.objects.refresh_for(instance)))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_similar_listing(sender, instance, **kwargs):
+    # The links to the post are deleted with it, remember who listed it
+    instance._similar_listing = list(SimilarPost.objects.filter(similar_post=instance)
+                                     .values_list('post_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def update_similar_posts_on_delete(sender, instance, **kwargs):
+    listing = getattr(instance, '_similar_listing', [])
+    if listing:
+        # fill the place the post left in their similar posts
+        SimilarPost.objects.rebuild(listing)
+        invalidate(*map(post_key, listing))
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def update_tag_counts_on_tagging(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post) or instance.status != Post.Status.PUBLISHED:
+        return
+    # pk_set only holds the tags actually added or removed
+    if action == 'post_add':
+        TagCount.objects.add(pk_set, 1)
+    elif action == 'post_remove':
+        TagCount.objects.add(pk_set, -1)
+    elif action == 'pre_clear':
+        # the tags are gone once post_clear is sent
+        TagCount.objects.add(instance.tags.values_list('id', flat=True), -1)
+
+
+@receiver(post_save, sender=Post)
+def update_tag_counts_on_save(sender, instance, created, **kwargs):
+    # Tags of a new post are added after it is saved, m2m_changed handles them
+    if created or not instance.has_changed('status'):
+        return
+    tag_ids = instance.tags.values_list('id', flat=True)
+    if getattr(instance, '_loaded_values', None) is None:
+        # Saved without having been loaded, the previous status is unknown
+        TagCount.objects.rebuild(list(tag_ids))
+    else:
+        was_published = instance.loaded_value('status') == Post.Status.PUBLISHED
+        if was_published == (instance.status == Post.Status.PUBLISHED):
+            return
+        TagCount.objects.add(tag_ids, -1 if was_published else 1)
+    invalidate('tags')
+
+
+@receiver(pre_delete, sender=Post)
+def update_tag_counts_on_delete(sender, instance, **kwargs):
+    # Before the delete cascades to the tagging rows
+    if instance.loaded_value('status', instance.status) == Post.Status.PUBLISHED:
+        TagCount.objects.add(instance.tags.values_list('id', flat=True), -1)
+        invalidate('tags')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_caches(sender, instance, created=False, **kwargs):
+    # Drafts never show up in the sidebar, so editing one keeps the cache
+    if not is_or_was_published(instance):
+        return
+    # Pages already showing the post carry its surrogate key. A post that
+    # was just published or re-dated also enters the post list and the
+    # listings of its tags (a new post has no tags yet, see below).
+    keys = ['sidebar', 'posts', 'list', post_key(instance.pk)]
+    if not created and (instance.has_changed('status') or instance.has_changed('publish')):
+        keys += map(tag_key, instance.tags.values_list('slug', flat=True))
+    invalidate(*keys)
+
+
+def add_to_comment_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        active_comment_count=F('active_comment_count') + delta)
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_count_on_save(sender, instance, created, **kwargs):
+    new = (instance.post_id, instance.active)
+    if created:
+        old = (None, False)
+    elif getattr(instance, '_loaded_values', None) is None:
+        # Saved without having been loaded, the previous state is unknown
+        Post.objects.filter(pk=instance.post_id).update_comment_counts()
+        return
+    else:
+        old = (instance.loaded_value('post_id'), instance.loaded_value('active'))
+    if old == new:
+        return
+    if old[1]:
+        add_to_comment_count(old[0], -1)
+    if new[1]:
+        add_to_comment_count(new[0], 1)
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_count_on_delete(sender, instance, **kwargs):
+    if instance.active:
+        add_to_comment_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_caches(sender, instance, **kwargs):
+    keys = {post_key(instance.post_id)}
+    if getattr(instance, '_loaded_values', None) is not None:
+        # a comment moved to another post leaves the old one too
+        keys.add(post_key(instance.loaded_value('post_id')))
+    invalidate('sidebar', *keys)
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def invalidate_tagging_caches(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear':
+        # the tags are gone once post_clear is sent
+        invalidate(*map(tag_key, instance.tags.values_list('slug', flat=True)))
+    elif action in ('post_add', 'post_remove'):
+        slugs = Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True) if pk_set else []
+        invalidate('tags', post_key(instance.pk), *map(tag_key, slugs))
+    elif action == 'post_clear':
+        invalidate('tags', post_key(instance.pk))
+
+
+@receiver(pre_save, sender=Tag)
+def remember_tag_slug(sender, instance, **kwargs):
+    # Tag is taggit's model, read the stored slug to purge its listing if it changes
+    instance._stored_slug = (Tag.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+                             if instance.pk else None)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_caches(sender, instance, **kwargs):
+    stored_slug = getattr(instance, '_stored_slug', None)
+    keys = {tag_key(instance.slug), *([tag_key(stored_slug)] if stored_slug else [])}
+    invalidate('tags', *keys)
@@ -1,4 +1,5 @@
 from django.contrib.sitemaps import Sitemap
+from django.db.models import Max
 
 from .models import Post
 
@@ -6,9 +7,18 @@ from .models import Post
 class PostSitemap(Sitemap):
     changefreq = 'weekly'
     priority = 0.9
+    # URLs per sitemap page, the protocol allows at most 50,000.
+    # The sitemap index lists one entry per page.
+    limit = 10000
 
     def items(self):
-        return Post.published.all()
+        # Only the columns needed for the URL and lastmod, never the body.
+        # A stable order keeps page boundaries fixed between requests.
+        return Post.published.only('slug', 'publish', 'updated').order_by('publish', 'id')
 
     def lastmod(self, obj):
         return obj.updated
+
+    def get_latest_lastmod(self):
+        # The default loads every item to take the max of lastmod()
+        return Post.published.aggregate(latest=Max('updated'))['latest']
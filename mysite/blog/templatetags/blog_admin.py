@@ -0,0 +1,19 @@
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+
+register = template.Library()
+
+
+def cached_date_hierarchy(cl):
+    # blog.changelist.CachedChangeList caches the drilldown
+    if hasattr(cl, 'get_date_hierarchy'):
+        return cl.get_date_hierarchy()
+    return date_hierarchy(cl)
+
+
+# Same as the admin's {% date_hierarchy cl %}, see templates/admin/blog/change_list.html
+@register.tag(name='cached_date_hierarchy')
+def cached_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(parser, token, func=cached_date_hierarchy,
+                              template_name='date_hierarchy.html', takes_context=False)
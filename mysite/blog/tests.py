@@ -1,3 +1,1335 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import gzip
+import json
+import random
+import re
+import tempfile
+import threading
+import warnings
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Collate, Upper
+from django.test import (AsyncRequestFactory, Client, RequestFactory, TestCase,
+                         TransactionTestCase)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag
+
+from . import async_views, views
+from .admin import CommentAdmin
+from .benchmarking import compare_results, named_urls, run_benchmark, seed_corpus, url_requests
+from .cache import get_version
+from .changelist import EstimatedCountPaginator
+from .export import export_response
+from .management.commands.loadtest import compare_servers, histogram, parse_mix
+from .models import Comment, OutgoingEmail, Post, SimilarPost, TagCount
+from .search import AUTOCOMPLETE_TIMEOUT, RESULTS_PER_PAGE, autocomplete, title_fuzzy_matches
+from .sitemaps import PostSitemap
+from .templatetags.blog_tags import (get_most_commented_posts, show_latest_posts, tag_cloud,
+                                    total_posts)
+
+
+def create_post(title, author, body='Post body.', status=Post.Status.PUBLISHED, **kwargs):
+    """
+    Create a post with the given `title` written by `author`, published by default.
+    """
+    return Post.objects.create(title=title, slug=kwargs.pop('slug', title.lower().replace(' ', '-')),
+                               author=author, body=body, status=status, **kwargs)
+
+
+class PostSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        # versions are only bumped on commit, which tests roll back
+        cache.clear()
+        caches['search'].clear()
+
+    def test_search_vector_is_stored_on_save(self):
+        """
+        Saving a post stores its weighted search vector.
+        """
+        post = create_post('Django search', self.author, body='Full text search with Postgres.')
+        post.refresh_from_db()
+        self.assertIn("'postgr':", post.search_vector)
+        self.assertIn("'search':", post.search_vector)
+
+    def test_search_vector_is_kept_when_text_unchanged(self):
+        """
+        Saves that do not change the title or body do not re-tokenize them.
+        """
+        post = create_post('Django search', self.author)
+        post.status = Post.Status.DRAFT
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertFalse([q for q in queries if 'to_tsvector' in q['sql']])
+
+        post.body = 'New body.'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertTrue([q for q in queries if 'to_tsvector' in q['sql']])
+
+    def test_search_matches_body_and_title(self):
+        """
+        post_search finds published posts by body words and by similar titles.
+        """
+        by_body = create_post('First post', self.author, body='Learning about indexes.')
+        by_title = create_post('Indexing', self.author)
+        create_post('Draft indexes', self.author, status=Post.Status.DRAFT)
+
+        response = self.client.get(reverse('blog:post_search'), {'query': 'indexes'})
+        self.assertCountEqual(response.context['results'], [by_body, by_title])
+
+    def test_search_keeps_titles_more_similar_than_the_threshold(self):
+        """
+        Titles more than 0.1 similar to the query match, not only those above
+        pg_trgm's default threshold of 0.3.
+        """
+        loose = create_post('Notes on reindexing the catalog', self.author)
+        create_post('Unrelated', self.author)
+        response = self.client.get(reverse('blog:post_search'), {'query': 'indexes'})
+        self.assertEqual(list(response.context['results']), [loose])
+
+    def test_results_are_paginated_with_highlighted_snippets(self):
+        """
+        post_search shows RESULTS_PER_PAGE posts, with the matched words of
+        their body marked and the rest escaped.
+        """
+        for i in range(RESULTS_PER_PAGE + 2):
+            create_post(f'Post {i}', self.author, body=f'Paging <b>through</b> results {i}.')
+
+        response = self.client.get(reverse('blog:post_search'), {'query': 'paging', 'page': 2})
+        page = response.context['results']
+        self.assertEqual(page.paginator.count, RESULTS_PER_PAGE + 2)
+        self.assertEqual(len(page), 2)
+        self.assertIn('<mark>Paging</mark>', page[0].snippet)
+        self.assertNotIn('<b>', page[0].snippet)
+        self.assertContains(response, 'page=1">Previous</a>')
+        self.assertContains(response, f'Found {RESULTS_PER_PAGE + 2} results')
+
+    def test_result_count_shows_the_cap(self):
+        """
+        Queries matching more than SEARCH_MAX_RESULTS posts say so.
+        """
+        for i in range(3):
+            create_post(f'Capped {i}', self.author)
+        url = reverse('blog:post_search')
+        with mock.patch('blog.search.SEARCH_MAX_RESULTS', 2):
+            response = self.client.get(url, {'query': 'capped'})
+        self.assertEqual(response.context['results'].paginator.count, 2)
+        self.assertContains(response, 'Found 2+ results')
+
+    def test_matching_ids_are_cached_until_posts_change(self):
+        """
+        Equivalent queries share the cached ids, publishing a post refreshes them.
+        """
+        first = create_post('Caching', self.author)
+        url = reverse('blog:post_search')
+        self.client.get(url, {'query': 'Caching'})
+        with self.assertNumQueries(1):
+            # only the rows of the page
+            response = self.client.get(url, {'query': '  caching '})
+        self.assertEqual(list(response.context['results']), [first])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = create_post('Caching again', self.author)
+        response = self.client.get(url, {'query': 'caching'})
+        self.assertCountEqual(response.context['results'], [first, second])
+
+    def test_multi_word_queries_make_valid_cache_keys(self):
+        """
+        Queries are hashed into the cache key, spaces and length included.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get(reverse('blog:post_search'), {'query': 'django orm ' * 30})
+        self.assertEqual(response.status_code, 200)
+
+    def test_autocomplete_prefixes_then_fuzzy_matches(self):
+        """
+        post_autocomplete lists titles starting with the text first, in
+        title order, then titles with similar words.
+        """
+        django = create_post('Django tips', self.author)
+        deploy = create_post('djangocon notes', self.author)
+        fuzzy = create_post('Learning Djangoo', self.author)
+        create_post('Django drafts', self.author, status=Post.Status.DRAFT)
+        create_post('Unrelated', self.author)
+
+        response = self.client.get(reverse('blog:post_autocomplete'), {'q': ' DJANGO '})
+        self.assertEqual(response['Cache-Control'], f'public, max-age={AUTOCOMPLETE_TIMEOUT}')
+        self.assertEqual(response.json()['results'], [
+            {'id': post.id, 'title': post.title, 'url': post.get_absolute_url()}
+            for post in (django, deploy, fuzzy)])
+
+        self.assertEqual(autocomplete('django', limit=1), [
+            {'id': django.id, 'title': 'Django tips', 'url': django.get_absolute_url()}])
+        self.assertEqual(autocomplete('d'), [])
+
+    def test_autocomplete_terms_make_valid_cache_keys(self):
+        """
+        Terms are hashed into the cache key, spaces and length included.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertEqual(autocomplete('django orm ' * 10), [])
+
+    def test_autocomplete_prefix_query_uses_index(self):
+        """
+        The prefix lookup matches the expression of blog_post_title_prefix_idx.
+        """
+        query = (Post.published.alias(title_key=Collate(Upper('title'), 'C'))
+                 .filter(title_key__startswith='DJ').order_by('title_key'))
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            self.assertIn('blog_post_title_prefix_idx', query.explain())
+
+    def test_autocomplete_fuzzy_matches_rank_the_newest_candidates(self):
+        """
+        Fuzzy suggestions are the nearest titles among the newest
+        FUZZY_CANDIDATES matches, the same ones on every call.
+        """
+        now = timezone.now()
+        nearest = create_post('Pythn', self.author, publish=now - datetime.timedelta(days=1))
+        newer = [create_post(f'Pythonic idioms {i}', self.author, publish=now - datetime.timedelta(hours=i))
+                 for i in range(3)]
+        self.assertEqual(title_fuzzy_matches('pythn', 1, []), [nearest])
+        with mock.patch('blog.search.FUZZY_CANDIDATES', 2):
+            self.assertEqual(title_fuzzy_matches('pythn', 2, []), newer[:2])
+            self.assertEqual(title_fuzzy_matches('pythn', 2, []), newer[:2])
+
+    def test_update_search_vectors_backfills_missing_vectors(self):
+        """
+        The update_search_vectors command fills in posts saved without a vector.
+        """
+        post = create_post('Backfill', self.author)
+        Post.objects.filter(pk=post.pk).update(search_vector=None)
+
+        call_command('update_search_vectors', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertIsNotNone(post.search_vector)
+
+
+class PostListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        now = timezone.now()
+        # Two posts share a publish time to exercise the id tie-breaker
+        cls.posts = [
+            create_post(f'Post {i}', cls.author,
+                        publish=now - datetime.timedelta(days=i // 2))
+            for i in range(7)
+        ]
+        cls.newest_first = sorted(cls.posts, key=lambda p: (p.publish, p.id), reverse=True)
+
+    def setUp(self):
+        # anonymous pages may still be cached by earlier tests
+        cache.clear()
+
+    def test_cursor_pages_walk_forward_and_back(self):
+        """
+        Following next cursors visits every post once in (publish, id) order,
+        and the previous cursor returns to the preceding page.
+        """
+        url = reverse('blog:post_list')
+        seen, pages, params = [], [], {}
+        while True:
+            page = self.client.get(url, params).context['posts']
+            pages.append(page)
+            seen.extend(page)
+            if not page.has_next():
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(len(pages), 3)
+
+        previous = self.client.get(url, {'before': pages[2].previous_cursor}).context['posts']
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertTrue(previous.has_previous())
+
+    def test_tag_filtered_list(self):
+        """
+        post_list_by_tag paginates only the posts carrying the tag.
+        """
+        for post in self.posts[:4]:
+            post.tags.add('django')
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        first = self.client.get(url).context['posts']
+        second = self.client.get(url, {'after': first.next_cursor}).context['posts']
+        self.assertEqual(list(first) + list(second),
+                         [p for p in self.newest_first if p in self.posts[:4]])
+        self.assertFalse(second.has_next())
+
+    def test_class_based_view_links_its_pages(self):
+        """
+        PostListView renders the same cursor links from its page_obj.
+        """
+        request = RequestFactory().get(reverse('blog:post_list'))
+        request.user = AnonymousUser()
+        response = views.PostListView.as_view()(request)
+        page = response.context_data['page_obj']
+        self.assertContains(response, f'?after={page.next_cursor}">Next</a>')
+
+    def test_invalid_cursor_shows_first_page(self):
+        """
+        A malformed cursor falls back to the first page.
+        """
+        response = self.client.get(reverse('blog:post_list'), {'after': 'not-a-cursor'})
+        self.assertEqual(list(response.context['posts']), self.newest_first[:3])
+
+        # Decodes to [null, null], which no seek condition can compare to
+        null_cursor = base64.urlsafe_b64encode(b'[null,null]').decode()
+        for param in ('after', 'before'):
+            response = self.client.get(reverse('blog:post_list'), {param: null_cursor})
+            self.assertEqual(list(response.context['posts']), self.newest_first[:3])
+
+
+class PostRenderingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def test_body_is_rendered_on_save(self):
+        """
+        Saving a post stores its rendered body and a truncated excerpt.
+        """
+        post = create_post('Markdown', self.author, body='**bold** ' + 'word ' * 40)
+        self.assertIn('<strong>bold</strong>', post.body_html)
+        self.assertIn('…', post.excerpt_html)
+
+    def test_body_is_rendered_only_when_changed(self):
+        """
+        Saving a post without editing its body keeps the stored HTML.
+        """
+        post = create_post('Markdown', self.author, body='*one*')
+        post = Post.objects.get(pk=post.pk)
+        Post.objects.filter(pk=post.pk).update(body_html='cached')
+        post.body_html = 'cached'
+
+        post.title = 'Renamed'
+        post.save()
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, 'cached')
+
+        post.body = '*two*'
+        post.save(update_fields=['body'])
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, '<p><em>two</em></p>')
+
+    def test_render_posts_backfills_html(self):
+        """
+        The render_posts command renders posts that have no stored HTML.
+        """
+        post = create_post('Backfill', self.author, body='# Title')
+        Post.objects.filter(pk=post.pk).update(body_html='', excerpt_html='')
+
+        call_command('render_posts', workers=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<h1>Title</h1>')
+        self.assertEqual(post.excerpt_html, '<h1>Title</h1>')
+
+    def test_feed_uses_stored_excerpt(self):
+        """
+        The RSS feed describes items with the stored excerpt.
+        """
+        post = create_post('Feed', self.author, body='Feed body')
+        Post.objects.filter(pk=post.pk).update(excerpt_html='<p>Stored excerpt</p>')
+        response = self.client.get(reverse('blog:post_feed'))
+        self.assertContains(response, 'Stored excerpt')
+
+
+class SidebarCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.post = create_post('Cached', cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_sidebar_runs_no_queries(self):
+        """
+        Once cached, the sidebar tags do not query the database.
+        """
+        total_posts(), show_latest_posts(3), list(get_most_commented_posts())
+        with self.assertNumQueries(0):
+            self.assertEqual(total_posts(), 1)
+            self.assertEqual(show_latest_posts(3)['latest_posts'], [self.post])
+            self.assertEqual(get_most_commented_posts(), [self.post])
+
+    def test_invalidation_waits_for_the_commit(self):
+        """
+        Requests running before the writer commits keep the old version, so
+        they cannot cache uncommitted data under the new one.
+        """
+        version = get_version('sidebar')
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_post('Uncommitted', self.author)
+        self.assertEqual(get_version('sidebar'), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_version('sidebar'), version)
+
+    def test_publishing_invalidates_sidebar(self):
+        """
+        Publishing or unpublishing a post refreshes the cached counts.
+        """
+        self.assertEqual(total_posts(), 1)
+        draft = create_post('Draft', self.author, status=Post.Status.DRAFT)
+        self.assertEqual(total_posts(), 1)
+
+        draft.status = Post.Status.PUBLISHED
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.save()
+        self.assertEqual(total_posts(), 2)
+
+        draft.status = Post.Status.DRAFT
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.save()
+        self.assertEqual(total_posts(), 1)
+
+    def test_comments_invalidate_most_commented(self):
+        """
+        Adding or deleting a comment refreshes the most commented posts.
+        """
+        other = create_post('Other', self.author)
+        self.assertEqual(get_most_commented_posts(1)[0].active_comment_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.create(post=other, name='A', email='a@example.com', body='Hi')
+        self.assertEqual(get_most_commented_posts(1), [other])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.delete()
+        self.assertEqual(get_most_commented_posts(1)[0].active_comment_count, 0)
+
+
+def create_comment(post, active=True, **kwargs):
+    return Comment.objects.create(post=post, name='Reader', email='reader@example.com',
+                                  body=kwargs.pop('body', 'Nice post.'), active=active, **kwargs)
+
+
+class ActiveCommentCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        self.post = create_post('Counted', self.author)
+
+    def count(self):
+        return Post.objects.get(pk=self.post.pk).active_comment_count
+
+    def test_post_comment_increments_count(self):
+        """
+        Posting a comment through post_comment increments the counter.
+        """
+        self.client.post(reverse('blog:post_comment', args=[self.post.id]),
+                         {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi'})
+        self.assertEqual(self.count(), 1)
+
+    def test_activation_changes_and_deletes_update_count(self):
+        """
+        Deactivating, reactivating and deleting comments keep the counter in step.
+        """
+        comment = create_comment(self.post)
+        create_comment(self.post, active=False)
+        self.assertEqual(self.count(), 1)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.active = False
+        comment.save()
+        self.assertEqual(self.count(), 0)
+
+        comment.active = True
+        comment.save()
+        comment.save()
+        self.assertEqual(self.count(), 1)
+
+        comment.delete()
+        self.assertEqual(self.count(), 0)
+
+    def test_saving_post_keeps_count(self):
+        """
+        Saving a post loaded before new comments arrived keeps the counter.
+        """
+        stale = Post.objects.get(pk=self.post.pk)
+        create_comment(self.post)
+        stale.title = 'Edited'
+        stale.save()
+        self.assertEqual(self.count(), 1)
+
+    def test_admin_actions_update_count(self):
+        """
+        The CommentAdmin activate/deactivate actions recount affected posts.
+        """
+        comment = create_comment(self.post)
+        create_comment(self.post)
+        comment_admin = CommentAdmin(Comment, site)
+        comment_admin.set_active(Comment.objects.all(), False)
+        self.assertEqual(self.count(), 0)
+        comment_admin.set_active(Comment.objects.filter(pk=comment.pk), True)
+        self.assertEqual(self.count(), 1)
+
+    def test_reconcile_repairs_drift(self):
+        """
+        reconcile_comment_counts fixes counters that drifted.
+        """
+        create_comment(self.post)
+        Post.objects.filter(pk=self.post.pk).update(active_comment_count=7)
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        self.assertEqual(self.count(), 1)
+        self.assertIn('repaired 1', out.getvalue())
+
+
+@mock.patch('blog.views.COMMENTS_PER_PAGE', 2)
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = create_post('Discussed', User.objects.create_user('author'))
+        cls.comments = [create_comment(cls.post, body=f'Comment body {i}') for i in range(3)]
+        create_comment(cls.post, active=False, body='Hidden')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detail_renders_first_page_with_load_more_link(self):
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertEqual(list(response.context['comments']), self.comments[:2])
+        self.assertContains(response, 'Comment 2 by Reader')
+        self.assertNotContains(response, 'Comment body 2')
+        self.assertContains(response, 'class="load-more"')
+
+    def test_load_more_continues_after_cursor(self):
+        first = self.client.get(self.post.get_absolute_url()).context['comments']
+        url = reverse('blog:post_comments', args=[self.post.id])
+        response = self.client.get(url, {'after': first.next_cursor, 'start': 2})
+        self.assertContains(response, 'Comment 3 by Reader')
+        self.assertContains(response, 'Comment body 2')
+        self.assertNotContains(response, 'Hidden')
+        self.assertNotContains(response, 'load-more')
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual([c['body'] for c in data['comments']], ['Comment body 0', 'Comment body 1'])
+        self.assertNotIn('email', data['comments'][0])
+        self.assertEqual(self.client.get(url, {'after': data['next']}, HTTP_ACCEPT='application/json')
+                         .json(), {'comments': [mock.ANY], 'next': None})
+
+        self.assertEqual(self.client.get(url, {'after': 'nope'}).status_code, 400)
+        null_cursor = base64.urlsafe_b64encode(b'[null,null]').decode()
+        self.assertEqual(self.client.get(url, {'after': null_cursor}).status_code, 400)
+
+    def test_page_query_uses_partial_index(self):
+        query = self.post.comments.filter(active=True).order_by('created', 'id')[:3]
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            self.assertIn('blog_comment_active_post_idx', query.explain())
+
+
+class SimilarPostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.post = create_post('Main', self.author, publish=now)
+        self.post.tags.add('a', 'b', 'c')
+        self.close = create_post('Close', self.author, publish=now - datetime.timedelta(days=2))
+        self.close.tags.add('a', 'b')
+        self.far = create_post('Far', self.author, publish=now - datetime.timedelta(days=1))
+        self.far.tags.add('c')
+
+    def similar(self, post):
+        response = self.client.get(post.get_absolute_url())
+        return response.context['similar_posts']
+
+    def test_similar_posts_ordered_by_shared_tags(self):
+        """
+        post_detail lists posts sharing the most tags first, both ways.
+        """
+        self.assertEqual(self.similar(self.post), [self.close, self.far])
+        self.assertEqual(self.similar(self.far), [self.post])
+
+    def test_tag_and_status_changes_update_links(self):
+        """
+        Changing tags or unpublishing a post updates the precomputed links.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.far.tags.add('a', 'b')
+        self.assertEqual(self.similar(self.post), [self.far, self.close])
+
+        self.far.status = Post.Status.DRAFT
+        with self.captureOnCommitCallbacks(execute=True):
+            self.far.save()
+        self.assertEqual(self.similar(self.post), [self.close])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.close.tags.clear()
+        self.assertEqual(self.similar(self.post), [])
+
+    def test_rebuild_matches_incremental_updates(self):
+        """
+        rebuild_similar_posts recreates the same links as the signal handlers.
+        """
+        fields = ('post', 'similar_post', 'shared_tag_count', 'similar_publish')
+        incremental = set(SimilarPost.objects.values_list(*fields))
+        SimilarPost.objects.all().delete()
+
+        call_command('rebuild_similar_posts', stdout=StringIO())
+        self.assertEqual(set(SimilarPost.objects.values_list(*fields)), incremental)
+        self.assertEqual(len(incremental), 4)
+
+    def test_incremental_updates_keep_only_the_top_posts(self):
+        """
+        After any sequence of tag, status and deletion changes, every post
+        keeps exactly the top SIMILAR_POSTS_KEPT links a rebuild would store.
+        """
+        rng = random.Random(0)
+        now = timezone.now()
+        posts = [self.post, self.close, self.far] + [
+            create_post(f'Extra {i}', self.author, publish=now - datetime.timedelta(days=i + 3))
+            for i in range(6)]
+        fields = ('post', 'similar_post', 'shared_tag_count', 'similar_publish')
+        with mock.patch('blog.models.SIMILAR_POSTS_KEPT', 2):
+            for step in range(60):
+                post = rng.choice(posts)
+                action = rng.choice(['add', 'add', 'remove', 'status', 'delete'] if step > 30
+                                    else ['add', 'add', 'remove', 'status'])
+                if action == 'add':
+                    post.tags.add(*rng.sample('abcde', 2))
+                elif action == 'remove':
+                    post.tags.remove(rng.choice('abcde'))
+                elif action == 'status':
+                    post.status = rng.choice(Post.Status.values)
+                    post.save()
+                elif len(posts) > 4:
+                    posts.remove(post)
+                    post.delete()
+
+                with self.subTest(step=step, action=action):
+                    incremental = set(SimilarPost.objects.values_list(*fields))
+                    SimilarPost.objects.all().delete()
+                    SimilarPost.objects.rebuild([p.id for p in posts])
+                    self.assertEqual(set(SimilarPost.objects.values_list(*fields)), incremental)
+        counts = SimilarPost.objects.values('post').annotate(links=Count('id'))
+        self.assertLessEqual(max(row['links'] for row in counts), 2)
+
+    def test_refresh_reports_only_changed_lists(self):
+        unrelated = create_post('Unrelated', self.author)
+        unrelated.tags.add('z')
+        self.assertEqual(SimilarPost.objects.refresh_for(unrelated), [])
+        self.assertEqual(SimilarPost.objects.refresh_for(self.post), [])
+
+        self.far.tags.add('a')
+        self.assertEqual(SimilarPost.objects.refresh_for(self.far), [])
+
+
+class TagCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        cache.clear()
+        self.first = create_post('First', self.author)
+        self.first.tags.add('django', 'python')
+        self.second = create_post('Second', self.author)
+        self.second.tags.add('django')
+        self.draft = create_post('Draft', self.author, status=Post.Status.DRAFT)
+        self.draft.tags.add('django', 'drafts')
+
+    def counts(self):
+        return dict(TagCount.objects.filter(post_count__gt=0)
+                    .values_list('tag__slug', 'post_count'))
+
+    def test_counts_follow_tags_and_status(self):
+        """
+        Only published posts are counted, updated as tags and statuses change.
+        """
+        self.assertEqual(self.counts(), {'django': 2, 'python': 1})
+
+        self.draft.status = Post.Status.PUBLISHED
+        self.draft.save()
+        self.assertEqual(self.counts(), {'django': 3, 'python': 1, 'drafts': 1})
+
+        self.first.tags.remove('python')
+        self.second.tags.clear()
+        self.assertEqual(self.counts(), {'django': 2, 'drafts': 1})
+
+        self.first.status = Post.Status.DRAFT
+        self.first.save()
+        self.draft.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_rebuild_matches_incremental_updates(self):
+        incremental = self.counts()
+        TagCount.objects.all().delete()
+
+        call_command('rebuild_tag_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), incremental)
+
+    def test_tag_list(self):
+        """
+        The tag directory lists the tags in use alphabetically with their counts.
+        """
+        response = self.client.get(reverse('blog:tag_list'))
+        self.assertEqual([(tag_count.tag.slug, tag_count.post_count)
+                          for tag_count in response.context['tags']],
+                         [('django', 2), ('python', 1)])
+        self.assertContains(response, 'class="tag-size-5"')
+
+    def test_tag_cloud_is_cached_until_tags_change(self):
+        tag_cloud()
+        with self.assertNumQueries(0):
+            self.assertEqual([(item['tag'].slug, item['size']) for item in tag_cloud()['tags']],
+                             [('django', 5), ('python', 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.tags.add('python')
+        self.assertEqual([item['size'] for item in tag_cloud()['tags']], [1, 1])
+
+
+class PostShareOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = create_post('Shared', User.objects.create_user('author'))
+
+    def share(self, to='friend@example.com'):
+        return self.client.post(reverse('blog:post_share', args=[self.post.id]), {
+            'name': 'Reader', 'email': 'reader@example.com', 'to': to, 'comments': 'Read it'})
+
+    def test_share_only_enqueues(self):
+        """
+        post_share stores the email in the outbox without sending it.
+        """
+        response = self.share()
+        self.assertTrue(response.context['sent'])
+        self.assertEqual(mail.outbox, [])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.recipients, ['friend@example.com'])
+        self.assertIn("Reader's comments: Read it", email.message)
+
+    def test_worker_sends_pending_emails_over_one_connection(self):
+        """
+        send_queued_mail delivers every pending email and marks it sent.
+        """
+        for i in range(3):
+            self.share(f'friend{i}@example.com')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_:
+            call_command('send_queued_mail', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.Status.SENT).exists())
+        # one backend instance is reused for every message
+        self.assertEqual(len({id(m.connection) for m in mail.outbox}), 1)
+        self.assertTrue(open_.called)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        """
+        A failed delivery is rescheduled, and marked failed after the last attempt.
+        """
+        self.share()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError('SMTP down')):
+            call_command('send_queued_mail', backoff=60, max_attempts=2, stdout=StringIO())
+            email = OutgoingEmail.objects.get()
+            self.assertEqual(email.status, OutgoingEmail.Status.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.next_attempt, timezone.now() + datetime.timedelta(seconds=50))
+            self.assertIn('SMTP down', email.last_error)
+
+            OutgoingEmail.objects.update(next_attempt=timezone.now())
+            call_command('send_queued_mail', max_attempts=2, stdout=StringIO())
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.FAILED)
+        self.assertEqual(mail.outbox, [])
+
+    def test_emails_are_sent_outside_the_claiming_transaction(self):
+        """
+        Sending happens after the batch is claimed and committed, and each
+        result is recorded at once, so a crash does not resend delivered emails.
+        """
+        for i in range(2):
+            self.share(f'friend{i}@example.com')
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def send_messages(messages):
+            depths.append(len(connection.atomic_blocks))
+            if len(depths) == 2:
+                raise KeyboardInterrupt
+            return len(messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=send_messages):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('send_queued_mail', lease=300, stdout=StringIO())
+        self.assertEqual(depths, [depth, depth])
+        first, second = OutgoingEmail.objects.order_by('id')
+        self.assertEqual(first.status, OutgoingEmail.Status.SENT)
+        # still leased to the crashed worker, retried once the lease expires
+        self.assertEqual(second.status, OutgoingEmail.Status.PENDING)
+        self.assertEqual(second.attempts, 1)
+        self.assertGreater(second.next_attempt, timezone.now() + datetime.timedelta(seconds=250))
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        cache.clear()
+        self.post = create_post('Validated', self.author)
+
+    def assertNotModified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        return response
+
+    def test_detail_not_modified_until_a_comment_is_added(self):
+        """
+        post_detail answers 304 for a matching ETag, and a new comment changes it.
+        """
+        url = self.post.get_absolute_url()
+        response = self.assertNotModified(url)
+        self.assertEqual(response['Last-Modified'],
+                         self.client.get(url)['Last-Modified'])
+
+        create_comment(self.post)
+        changed = self.client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+
+    def test_list_feed_and_sitemap_change_on_publish(self):
+        """
+        The list, feed and sitemap validators change when a post is published.
+        """
+        urls = [reverse('blog:post_list'), reverse('blog:post_feed'), '/sitemap.xml']
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            etags[url] = response['ETag']
+            cached = self.client.get(url, headers={'if-none-match': response['ETag']})
+            self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_post('Another', self.author)
+        for url in urls:
+            response = self.client.get(url, headers={'if-none-match': etags[url]})
+            self.assertEqual(response.status_code, 200, url)
+
+
+class SitemapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.posts = [create_post(f'Mapped {i}', author) for i in range(3)]
+        create_post('Hidden', author, status=Post.Status.DRAFT)
+
+    def test_index_lists_one_sitemap_per_page(self):
+        """
+        The sitemap index splits posts into pages of PostSitemap.limit URLs.
+        """
+        with mock.patch.object(PostSitemap, 'limit', 2):
+            index = self.client.get('/sitemap.xml')
+            self.assertContains(index, '/sitemap-posts.xml', count=2)
+            self.assertContains(index, '/sitemap-posts.xml?p=2')
+            page = self.client.get('/sitemap-posts.xml', {'p': 2})
+        self.assertContains(page, '<url>', count=1)
+
+    def test_build_sitemaps_writes_static_files(self):
+        """
+        build_sitemaps streams published posts into gzipped pages and an index.
+        """
+        with tempfile.TemporaryDirectory() as output:
+            call_command('build_sitemaps', output=output, limit=2, gzip=True,
+                         base_url='https://example.com', stdout=StringIO())
+            index = (Path(output) / 'sitemap.xml').read_text()
+            self.assertIn('https://example.com/sitemap-posts-2.xml.gz', index)
+            urls = ''.join(gzip.open(Path(output) / f'sitemap-posts-{n}.xml.gz', 'rt').read()
+                           for n in (1, 2))
+        for post in self.posts:
+            self.assertIn(f'https://example.com{post.get_absolute_url()}', urls)
+        self.assertNotIn('hidden', urls)
+
+
+class FeedCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def setUp(self):
+        cache.clear()
+        self.post = create_post('Fed', self.author)
+        self.post.tags.add('django')
+
+    def test_feed_is_cached_until_a_post_changes(self):
+        """
+        Repeated feed requests are served from the cache, and editing a
+        published post rebuilds the feed.
+        """
+        url = reverse('blog:post_feed')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'Fed')
+
+        self.post.title = 'Refed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.save()
+        self.assertContains(self.client.get(url), 'Refed')
+
+    def test_tag_feed(self):
+        """
+        The per-tag feed lists the tag's posts, follows tag changes, and is
+        404 for unknown tags.
+        """
+        other = create_post('Untagged', self.author)
+        url = reverse('blog:post_feed_by_tag', args=['django'])
+        response = self.client.get(url)
+        self.assertContains(response, 'posts tagged "django"')
+        self.assertNotContains(response, 'Untagged')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.tags.add('django')
+        self.assertContains(self.client.get(url), 'Untagged')
+        self.assertEqual(self.client.get(reverse('blog:post_feed_by_tag', args=['nope'])).status_code, 404)
+
+    def test_feed_links_follow_the_request_scheme(self):
+        """
+        A feed cached for an http request is not served to https readers.
+        """
+        url = reverse('blog:post_feed')
+        self.assertContains(self.client.get(url), 'http://')
+        response = self.client.get(url, secure=True)
+        self.assertContains(response, f'https://example.com{self.post.get_absolute_url()}')
+        self.assertNotContains(response, 'http://example.com')
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.post = create_post('Cached', self.author)
+        self.post.tags.add('django')
+        self.other = create_post('Other', self.author)
+        self.other.tags.add('python')
+
+    def test_anonymous_pages_are_served_from_the_cache(self):
+        """
+        A repeated anonymous list request runs no query and carries the
+        surrogate keys of the page.
+        """
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Cached')
+        self.assertCountEqual(response['Surrogate-Key'].split(),
+                              ['list', f'post:{self.other.id}', f'post:{self.post.id}',
+                               'sidebar', 'tag:django', 'tag:python'])
+
+    def test_unused_query_parameters_share_the_page(self):
+        """
+        Parameters the views don't read, like tracking tags, are served the
+        cached page instead of adding entries.
+        """
+        url = reverse('blog:post_list')
+        self.client.get(url, {'utm_source': 'feed'})
+        with self.assertNumQueries(0):
+            self.client.get(url, {'utm_source': 'mail', 'utm_medium': 'x'})
+        self.client.get(url, {'page': '2'})
+        self.assertEqual(len([key for key in cache._cache if ':blog:page:' in key]), 2)
+
+    def test_renaming_a_tag_purges_its_old_listing(self):
+        """
+        The cached listing under the old slug of a renamed tag is purged.
+        """
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        self.client.get(url)
+        tag = Tag.objects.get(slug='django')
+        tag.slug = 'django-web'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_sidebar_changes_do_not_purge_pages(self):
+        """
+        The sidebar is spliced into cached pages, so a comment refreshes it
+        everywhere without re-rendering the pages of other posts.
+        """
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_comment(self.other, body='Elsewhere')
+
+        with mock.patch('blog.views.paginate_comments', wraps=views.paginate_comments) as render:
+            response = self.client.get(url)
+        self.assertFalse(render.called)
+        most_commented = response.content.decode().split('Most commented posts')[1]
+        self.assertLess(most_commented.index('Other'), most_commented.index('Cached'))
+
+    def test_changes_purge_only_the_affected_pages(self):
+        """
+        Tagging a post purges its own page, the tag listing and the posts
+        it became similar to, while the page of an unrelated post stays cached.
+        """
+        unrelated = create_post('Unrelated', self.author)
+        tag_url = reverse('blog:post_list_by_tag', args=['python'])
+        for url in (self.post.get_absolute_url(), self.other.get_absolute_url(),
+                    unrelated.get_absolute_url(), tag_url):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.tags.add('python')
+
+        self.assertContains(self.client.get(tag_url), 'Cached')
+        self.assertContains(self.client.get(self.other.get_absolute_url()), 'Cached')
+        # only the conditional GET validators query, the page itself is cached
+        with self.assertNumQueries(1):
+            self.client.get(unrelated.get_absolute_url())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_comment(self.post, body='Fresh comment')
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'Fresh comment')
+
+    def test_cached_detail_page_has_the_visitor_csrf_token(self):
+        """
+        Every visitor of a cached detail page gets a working CSRF token of their own.
+        """
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+
+        visitor = Client(enforce_csrf_checks=True)
+        response = visitor.get(url)
+        self.assertNotContains(response, 'blog:csrf_token')
+        token = response.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        response = visitor.post(reverse('blog:post_comment', args=[self.post.id]),
+                                {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi',
+                                 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.login(username='author', password='secret')
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_covers_every_url(self):
+        """
+        The bench command has a working request for every named blog and polls URL.
+        """
+        corpus = seed_corpus(posts=5, tags=3, comments_per_post=2, questions=2, choices_per_question=2)
+        self.assertEqual(Post.published.count(), 5)
+        results = run_benchmark(Client(), url_requests(corpus), iterations=3, warmup=1,
+                                staff=corpus.staff)
+        self.assertCountEqual(results, named_urls())
+        for name, stats in results.items():
+            with self.subTest(url=name):
+                self.assertEqual(stats['errors'], 0)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        # the export is timed, not the redirect to the admin login
+        self.assertGreater(results['blog:export']['queries'], 0)
+
+    def test_compare_flags_slower_urls_and_extra_queries(self):
+        baseline = {'a': {'p95_ms': 10.0, 'queries': 2},
+                    'b': {'p95_ms': 10.0, 'queries': 2},
+                    'c': {'p95_ms': 10.0, 'queries': 2}}
+        results = {'a': {'p95_ms': 10.5, 'queries': 2},
+                   'b': {'p95_ms': 12.0, 'queries': 2},
+                   'c': {'p95_ms': 9.0, 'queries': 3}}
+        regressions = compare_results(results, baseline, threshold=10)
+        self.assertEqual([name for name, description in regressions], ['b', 'c'])
+
+
+class LoadTestTests(TestCase):
+    def test_parse_mix(self):
+        routes = ('blog:post_list', 'polls:vote')
+        self.assertEqual(parse_mix('blog:post_list=3, polls:vote=1', routes),
+                         {'blog:post_list': 3, 'polls:vote': 1})
+        with self.assertRaises(CommandError):
+            parse_mix('blog:nope=1', routes)
+
+    def test_histogram_buckets(self):
+        buckets = histogram([0.5, 1, 1.5, 30, 9000])
+        self.assertEqual(buckets['<=1'], 2)
+        self.assertEqual(buckets['<=2'], 1)
+        self.assertEqual(buckets['<=50'], 1)
+        self.assertEqual(buckets['>5000'], 1)
+        self.assertEqual(sum(buckets.values()), 5)
+
+    def test_compare_servers(self):
+        wsgi = {'throughput': 100, 'p95_ms': 20, 'routes': {
+            'blog:post_list': {'throughput': 60, 'p95_ms': 10}}}
+        asgi = {'throughput': 150, 'p95_ms': 15, 'routes': {
+            'blog:post_list': {'throughput': 30, 'p95_ms': 40}}}
+        comparison = compare_servers(wsgi, asgi)
+        self.assertEqual(comparison['all']['throughput_ratio'], 1.5)
+        self.assertEqual(comparison['blog:post_list']['throughput_ratio'], 0.5)
+        self.assertEqual(comparison['blog:post_list']['asgi_p95_ms'], 40)
+
+
+class ImportPostsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = Path(self.directory.name)
+
+    def write_jsonl(self, records):
+        source = self.path / 'posts.jsonl'
+        source.write_text('\n'.join(json.dumps(record) for record in records) + '\n')
+        return source
+
+    def records(self):
+        return [
+            {'title': 'First import', 'author': 'alice', 'body': 'Some *markdown*.',
+             'publish': '2024-01-02T10:00:00', 'tags': ['django', 'python'],
+             'comments': [{'name': 'Bob', 'email': 'bob@example.com', 'body': 'Great',
+                           'created': '2024-01-03T08:00:00'},
+                          {'name': 'Eve', 'email': 'eve@example.com', 'body': 'Spam',
+                           'active': False}]},
+            {'title': 'Second import', 'author': 'alice', 'body': 'More.',
+             'publish': '2024-01-05T10:00:00', 'tags': ['django']},
+            {'title': 'Draft import', 'body': 'Later.', 'status': 'draft'},
+        ]
+
+    def test_import_jsonl(self):
+        """
+        Posts, tags, comments and their derived columns are imported in chunks.
+        """
+        User.objects.create_user('admin')
+        call_command('import_posts', self.write_jsonl(self.records()), batch_size=2, stdout=StringIO())
+
+        first = Post.objects.get(slug='first-import')
+        self.assertEqual(first.author.username, 'alice')
+        self.assertEqual(first.body_html, '<p>Some <em>markdown</em>.</p>')
+        self.assertIn("'markdown':", first.search_vector)
+        self.assertCountEqual(first.tags.names(), ['django', 'python'])
+        self.assertEqual(first.active_comment_count, 1)
+        self.assertEqual(first.comments.get(name='Bob').created,
+                         timezone.make_aware(datetime.datetime(2024, 1, 3, 8)))
+        self.assertEqual(Post.objects.get(slug='draft-import').status, Post.Status.DRAFT)
+        self.assertEqual(Post.objects.get(slug='draft-import').author.username, 'admin')
+        self.assertTrue(SimilarPost.objects.filter(post=first, similar_post__slug='second-import').exists())
+        self.assertEqual(dict(TagCount.objects.values_list('tag__name', 'post_count')),
+                         {'django': 2, 'python': 1})
+
+        # Importing again skips the posts already there
+        call_command('import_posts', self.path / 'posts.jsonl', stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 3)
+
+    def test_resume_skips_imported_records(self):
+        source = self.write_jsonl(self.records())
+        state = self.path / 'state.json'
+        state.write_text(json.dumps({'source': str(source), 'position': 2}))
+        call_command('import_posts', source, state=state, resume=True, stdout=StringIO())
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ['draft-import'])
+        # the state is removed once the import completes
+        self.assertFalse(state.exists())
+
+    def test_import_markdown_directory(self):
+        (self.path / 'hello.md').write_text(
+            '---\ntitle: Hello Markdown\nauthor: carol\npublish: 2024-02-01 09:30\n'
+            'tags: [django, "web dev"]\n---\n# Heading\n\nText.\n')
+        call_command('import_posts', self.path, stdout=StringIO())
+        post = Post.objects.get(slug='hello-markdown')
+        self.assertEqual(post.body, '# Heading\n\nText.')
+        self.assertCountEqual(post.tags.slugs(), ['django', 'web-dev'])
+
+    def test_invalid_record_reports_its_location(self):
+        source = self.write_jsonl([{'body': 'No title'}])
+        with self.assertRaisesMessage(CommandError, f'{source}:1: missing title'):
+            call_command('import_posts', source, stdout=StringIO())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        cls.post = create_post('Exported', cls.author)
+        cls.active = create_comment(cls.post, body='Kept, with "quotes"')
+        cls.inactive = create_comment(cls.post, active=False, body='Hidden')
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_admin_action_streams_csv(self):
+        response = CommentAdmin(Comment, site).export_as_csv(None, Comment.objects.order_by('id'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('filename="comments.csv"', response['Content-Disposition'])
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], 'id,post_id,post__slug,name,email,body,active,created,updated')
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"Kept, with ""quotes"""', lines[1])
+
+    def test_endpoint_streams_filtered_jsonl(self):
+        self.staff.user_permissions.add(Permission.objects.get(codename='view_comment'))
+        self.client.login(username='staff', password='secret')
+        response = self.client.get(reverse('blog:export', args=['comments', 'jsonl']), {'active': '1'})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.active.id])
+        self.assertEqual(rows[0]['post__slug'], 'exported')
+
+        response = self.client.get(reverse('blog:export', args=['comments', 'csv']), {'since': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_asgi_export_is_an_async_stream(self):
+        """
+        Under ASGI the rows are read chunk by chunk by an async iterator,
+        instead of Django reading a sync one into a list.
+        """
+        request = AsyncRequestFactory().get('/export/comments.csv')
+        with mock.patch('blog.export.CHUNK_SIZE', 1):
+            response = export_response(Comment.objects.order_by('id'), ['id', 'body'], 'csv',
+                                       'comments', request)
+            self.assertTrue(response.is_async)
+
+            async def read():
+                return [chunk async for chunk in response.streaming_content]
+            chunks = async_to_sync(read)()
+        self.assertEqual([chunk.decode() for chunk in chunks],
+                         ['id,body\r\n', f'{self.active.id},"Kept, with ""quotes"""\r\n',
+                          f'{self.inactive.id},Hidden\r\n'])
+
+    def test_endpoint_requires_staff_with_view_permission(self):
+        url = reverse('blog:export', args=['posts', 'csv'])
+        self.assertRedirects(self.client.get(url), f'{reverse("admin:login")}?next={url}')
+        self.client.login(username='staff', password='secret')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class AdminChangeListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_superuser('admin', password='secret')
+        cls.django = create_post('Django tips', cls.author, body='Querysets are lazy.')
+        cls.other = create_post('Gardening', cls.author, body='Tomatoes need sun.')
+        cls.comment = Comment.objects.create(post=cls.django, name='Fan', email='fan@example.com',
+                                             body='Lovely tomatoes')
+        create_comment(cls.other, body='Querysets everywhere')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='admin', password='secret')
+
+    def test_counts_are_estimated_above_the_limit(self):
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_limit', 0):
+            self.assertGreater(EstimatedCountPaginator(Post.objects.all(), 10).count, 0)
+        with self.assertNumQueries(2):
+            # EXPLAIN, then the exact COUNT(*)
+            self.assertEqual(EstimatedCountPaginator(Post.objects.all(), 10).count, 2)
+
+    def test_facets_and_date_hierarchy_are_cached(self):
+        url = reverse('admin:blog_post_changelist')
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertContains(response, 'Django tips')
+        self.assertLess(len(second), len(first))
+
+    def test_post_search_uses_full_text(self):
+        response = self.client.get(reverse('admin:blog_post_changelist'), {'q': 'queryset'})
+        self.assertContains(response, 'Django tips')
+        self.assertNotContains(response, 'Gardening')
+
+    def test_comment_search_by_name_body_or_email(self):
+        url = reverse('admin:blog_comment_changelist')
+        response = self.client.get(url, {'q': 'tomato'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.comment])
+        response = self.client.get(url, {'q': self.comment.name})
+        self.assertEqual(list(response.context['cl'].result_list), [self.comment])
+        response = self.client.get(url, {'q': 'fan@example.com'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.comment])
+
+
+class AsyncViewTests(TransactionTestCase):
+    """
+    The async views run queries in worker threads with their own database
+    connections, which only see committed data.
+    """
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user('author')
+        self.post = create_post('Async Django', author, body='Concurrent querysets.')
+        self.post.tags.add('django')
+        self.similar = create_post('Similar', author)
+        self.similar.tags.add('django')
+        create_comment(self.post, body='Awaited comment')
+
+    def call(self, view, path, *args, **kwargs):
+        """
+        Return the content of `view` for an anonymous GET of `path`, without
+        its per-visitor CSRF token.
+        """
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+        request.auser = auser
+        cache.clear()
+        if asyncio.iscoroutinefunction(view):
+            response = async_to_sync(view)(request, *args, **kwargs)
+        else:
+            response = view(request, *args, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return re.sub(r'name="csrfmiddlewaretoken" value="[^"]+"', '', response.content.decode())
+
+    def test_pages_match_the_sync_views(self):
+        post = self.post
+        detail_args = [post.publish.year, post.publish.month, post.publish.day, post.slug]
+        pages = [
+            ('post_list', reverse('blog:post_list'), [], {}),
+            ('post_list', reverse('blog:post_list_by_tag', args=['django']), [], {'tag_slug': 'django'}),
+            ('post_detail', post.get_absolute_url(), detail_args, {}),
+            ('post_search', f'{reverse("blog:post_search")}?query=concurrent', [], {}),
+        ]
+        for name, path, args, kwargs in pages:
+            with self.subTest(path=path):
+                content = self.call(getattr(async_views, name), path, *args, **kwargs)
+                self.assertEqual(content, self.call(getattr(views, name), path, *args, **kwargs))
+                self.assertIn('Async Django', content)
+        detail = self.call(async_views.post_detail, post.get_absolute_url(), *detail_args)
+        self.assertIn('Awaited comment', detail)
+        self.assertIn('Similar', detail)
+
+    def test_independent_queries_run_concurrently(self):
+        # Each query waits for the other, so running them one after another fails
+        barrier = threading.Barrier(2, timeout=5)
+
+        def count(model):
+            barrier.wait()
+            return model.objects.count()
+
+        self.assertEqual(async_to_sync(async_views.concurrently)(
+            lambda: count(Post), lambda: count(Comment)), [2, 1])
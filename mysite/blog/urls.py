@@ -1,21 +1,32 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
-from .feeds import LatestPostsFeed
+from . import async_views, views
+from .feeds import LatestPostsFeed, TagPostsFeed
 
 app_name = 'blog'
 
+# Async versions of the list, detail and search pages for ASGI, see
+# settings.BLOG_ASYNC_VIEWS
+read_views = async_views if settings.BLOG_ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.post_list, name='post_list'),
+    path('', read_views.post_list, name='post_list'),
     # path('', views.PostListView.as_view(), name='post_list'),
-    path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'),
+    path('tag/<slug:tag_slug>/', read_views.post_list, name='post_list_by_tag'),
+    path('tags/', views.tag_list, name='tag_list'),
+    path('tag/<slug:tag_slug>/feed/', TagPostsFeed(), name='post_feed_by_tag'),
 
     path('<int:year>/<int:month>/<int:day>/<slug:post>/',
-         views.post_detail, name='post_detail'),
+         read_views.post_detail, name='post_detail'),
     path('<int:post_id>/share/', views.post_share, name="post_share"),
     path('<int:post_id>/comment/', views.post_comment, name="post_comment"),
+    path('<int:post_id>/comments/', views.post_comments, name='post_comments'),
 
     path('feed/', LatestPostsFeed(), name='post_feed'),
 
-    path('search/', views.post_search, name='post_search'),
+    path('search/', read_views.post_search, name='post_search'),
+    path('search/autocomplete/', views.post_autocomplete, name='post_autocomplete'),
+
+    path('export/<slug:model>.<slug:format>', views.export, name='export'),
 ]
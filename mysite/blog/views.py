@@ -1,23 +1,32 @@
-from django.contrib.postgres.search import (
-    SearchQuery,
-    SearchRank,
-    SearchVector,
-    TrigramSimilarity,
-)
-from django.core.mail import send_mail
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Count
-from django.http import Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_cache_control
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView
+from mysite.db_routing import read_only_view
+from mysite.query_budget import declare_query_budget
 from taggit.models import Tag
 
+from .conditional import conditional_view, post_detail_validators, post_list_validators
+from .export import EXPORTS, FORMATS, export_response, filter_export
 from .forms import CommentForm, EmailPostForm, SearchForm
-from .models import Post
+from .models import SIMILAR_POSTS_KEPT, OutgoingEmail, Post, SimilarPost, TagCount
+from .pagecache import add_surrogate_keys, cache_anonymous_page, post_key, tag_key
+from .paginator import CursorPaginator, InvalidCursor
+from .search import AUTOCOMPLETE_TIMEOUT, autocomplete, search_page
+
+COMMENTS_PER_PAGE = 20
+TAGS_PER_PAGE = 100
 
 
 # Search
+@declare_query_budget(5)
+# Only reads, served from the read replica, see mysite.db_routing
+@read_only_view
 def post_search(request):
     form = SearchForm()
     query = None
@@ -28,33 +37,8 @@ def post_search(request):
         if form.is_valid():
             query = form.cleaned_data['query']
 
-            # Search in title and body columns using SearchVector with stop words based on defined language
-            # search_vector = SearchVector('title', 'body', config='spanish')
-
-            """
-            In the preceding code, we apply different weights to the search vectors built using the title and body fields. The default weights are D, C, B, and A, and they refer to the numbers 0.1, 0.2, 0.4, and 1.0, respectively. We apply a weight of 1.0 to the title search vector (A) and a weight of 0.4 to the body vector (B). Title matches will prevail over body content matches. We filter the results to display only the ones with a rank higher than 0.3.
-            """
-            search_vector = SearchVector(
-                'title', weight='A') + SearchVector('body', weight='B')
-
-            # SearchQuery removes any stop words such as "a", "an", "of"...
-            '''
-            https://github.com/postgres/postgres/blob/master/src/backend/snowball/stopwords/spanish.stop
-            '''
-            # search_query = SearchQuery(query, config='spanish')
-            search_query = SearchQuery(query)
-
-            # Use SearchRank, ranking by number of occurrences of the search term
-            results = (Post.published.annotate(
-                similarity=TrigramSimilarity('title', query),
-                search=search_vector,
-                rank=SearchRank(search_vector, search_query)
-            )
-                # .filter(search=query)
-                # .filter(rank__gte=0.3)
-                .filter(similarity__gt=0.1)
-                .order_by('-rank')
-            )
+            # One page of the cached matching ids, see blog.search
+            results = search_page(query, request.GET.get('page'))
 
     return render(request, 'blog/post/search.html', {
         'form': form,
@@ -63,7 +47,19 @@ def post_search(request):
     })
 
 
+# Title suggestions for a type-ahead search box, e.g. /blog/search/autocomplete/?q=djan
+# {"results": [{"id": 1, "title": "Django tips", "url": "/blog/2024/1/2/django-tips/"}]}
+@declare_query_budget(2)
+@read_only_view
+def post_autocomplete(request):
+    response = JsonResponse({'results': autocomplete(request.GET.get('q', ''))})
+    # Browsers may reuse suggestions as long as the server does
+    patch_cache_control(response, public=True, max_age=AUTOCOMPLETE_TIMEOUT)
+    return response
+
+
 # Accept POST only otherwise throw 405 error
+@declare_query_budget(8)
 @require_POST
 def post_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
@@ -76,7 +72,9 @@ def post_comment(request, post_id):
         # Create a Comment object without saving it to the database
         comment = form.save(commit=False)
         comment.post = post
-        comment.save()
+        # the insert and the post's active_comment_count update commit together
+        with transaction.atomic():
+            comment.save()
 
     return render(request, 'blog/post/comment.html', {
         'post': post,
@@ -85,6 +83,7 @@ def post_comment(request, post_id):
     })
 
 
+@declare_query_budget(4)
 def post_share(request, post_id):
     post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
 
@@ -99,13 +98,20 @@ def post_share(request, post_id):
             post_url = request.build_absolute_uri(post.get_absolute_url())
             subject = (
                 f"{cd['name']} ({cd['email']}) " f"recommends you read {post.title}")
-            message = (f"Read {post.title} at {post_url}\n\n" f"{
-                       cd['name']}\s comments: {cd['comments']}")
-
-            send_mail(
+            message = (f"Read {post.title} at {post_url}\n\n"
+                       f"{cd['name']}'s comments: {cd['comments']}")
+
+            # Queue the email instead of talking to SMTP inside the request,
+            # `manage.py send_queued_mail` delivers it
+            # send_mail(
+            #     subject=subject,
+            #     message=message,
+            #     from_email=None,
+            #     recipient_list=[cd['to']]
+            # )
+            OutgoingEmail.objects.enqueue(
                 subject=subject,
                 message=message,
-                from_email=None,
                 recipient_list=[cd['to']]
             )
             sent = True
@@ -119,20 +125,58 @@ def post_share(request, post_id):
     })
 
 
+def paginate_comments(post, after=None):
+    """
+    Keyset-paginate the active comments of `post` on (created, id), oldest
+    first, so a post with thousands of comments renders one page of them.
+    """
+    paginator = CursorPaginator(post.comments.filter(active=True), COMMENTS_PER_PAGE,
+                                ordering=('created', 'id'))
+    return paginator.page(after=after)
+
+
+def paginate_posts(request, queryset, per_page):
+    """
+    Keyset-paginate `queryset` on (publish, id) using the `after`/`before`
+    cursors of the request, falling back to the first page on a bad cursor.
+    """
+    paginator = CursorPaginator(queryset, per_page, ordering=('-publish', '-id'))
+    try:
+        return paginator, paginator.page(after=request.GET.get('after'),
+                                         before=request.GET.get('before'))
+    except InvalidCursor:
+        # If the cursor is malformed, show the first page
+        return paginator, paginator.page()
+
+
 class PostListView(ListView):
     """
     Alternative post list view
     """
-    queryset = Post.published.all()
+    queryset = Post.published.select_related('author').prefetch_related('tags')
     context_object_name = 'posts'
     paginate_by = 3
+    query_budget = 5
     template_name = 'blog/post/list.html'
 
+    def paginate_queryset(self, queryset, page_size):
+        # Cursor pagination instead of Paginator's COUNT(*) + OFFSET
+        paginator, page = paginate_posts(self.request, queryset, page_size)
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 # Function-base views
 # Accept optional tag_slug parameter
+@declare_query_budget(6)
+@read_only_view
+# Answer 304 Not Modified without rendering when nothing changed
+@conditional_view(post_list_validators)
+# Anonymous visitors get the rendered page from the cache
+@cache_anonymous_page
 def post_list(request, tag_slug=None):
-    post_list = Post.published.all()
+    # list.html shows the author and tags of every post, load them with the page
+    # instead of one query per post
+    post_list = Post.published.select_related('author').prefetch_related('tags')
 
     # Filter Tag
     tag = None
@@ -140,17 +184,13 @@ def post_list(request, tag_slug=None):
         tag = get_object_or_404(Tag, slug=tag_slug)
         post_list = post_list.filter(tags__in=[tag])
 
-    # Pagination
-    paginator = Paginator(post_list, 3)
-    page_number = request.GET.get('page', 1)
-    try:
-        posts = paginator.page(page_number)
-    except PageNotAnInteger:
-        # If page_number is not int, show first page
-        posts = paginator.page(1)
-    except EmptyPage:
-        # If page_number is out of range, show the last page
-        posts = paginator.page(paginator.num_pages)
+    # Pagination, seeking on (publish, id) so deep pages cost the same as the first
+    paginator, posts = paginate_posts(request, post_list, 3)
+
+    # Surrogate keys of everything on the page, see blog.pagecache
+    add_surrogate_keys(request, tag_key(tag.slug) if tag else 'list',
+                       *(post_key(post.id) for post in posts),
+                       *(tag_key(t.slug) for post in posts for t in post.tags.all()))
 
     return render(request, 'blog/post/list.html', {
         'posts': posts,
@@ -158,12 +198,34 @@ def post_list(request, tag_slug=None):
     })
 
 
+# Every tag in use with its number of published posts, alphabetically.
+# The counts are read from TagCount instead of counting the tagging table.
+@declare_query_budget(6)
+@read_only_view
+@cache_anonymous_page
+def tag_list(request):
+    tag_counts = (TagCount.objects.filter(post_count__gt=0)
+                  .select_related('tag')
+                  .order_by('tag__name'))
+    tags = Paginator(tag_counts, TAGS_PER_PAGE).get_page(request.GET.get('page'))
+
+    add_surrogate_keys(request, 'tags')
+
+    return render(request, 'blog/post/tags.html', {
+        'tags': tags,
+    })
+
+
+@declare_query_budget(7)
+@read_only_view
+@conditional_view(post_detail_validators)
+@cache_anonymous_page
 def post_detail(request, year, month, day, post):
     # try:
     #     post = Post.published.get(id=id)
     # except Post.DoesNotExist:
     #     raise Http404("No Post found.")
-    post = get_object_or_404(Post,
+    post = get_object_or_404(Post.objects.select_related('author'),
                              status=Post.Status.PUBLISHED,
                              slug=post,
                              publish__year=year,
@@ -171,20 +233,26 @@ def post_detail(request, year, month, day, post):
                              publish__day=day,
                              )
 
-    # List of active comments for this post
-    comments = post.comments.filter(active=True)
+    # List of active comments for this post, the first page of them, the
+    # others are loaded by post_comments
+    # comments = post.comments.filter(active=True)
+    comments = paginate_comments(post)
 
     # Form for users to comment
     form = CommentForm()
 
     # List of similar posts (related posts)
-    post_tags_ids = post.tags.values_list('id', flat=True)
-    # Get all similar tags posts but exclude itself
-    similar_posts = Post.published.filter(
-        tags__in=post_tags_ids).exclude(id=post.id)
-    # use Count aggregation function to generate a calculated field "same_tags"
-    similar_posts = similar_posts.annotate(same_tags=Count(
-        'tags')).order_by('-same_tags', '-publish')[:4]
+    # Precomputed in SimilarPost, one index scan instead of joining every
+    # post sharing a tag and counting:
+    # post_tags_ids = post.tags.values_list('id', flat=True)
+    # similar_posts = Post.published.filter(
+    #     tags__in=post_tags_ids).exclude(id=post.id)
+    # similar_posts = similar_posts.annotate(same_tags=Count(
+    #     'tags')).order_by('-same_tags', '-publish')[:4]
+    similar_posts = get_similar_posts(post)
+
+    add_surrogate_keys(request, post_key(post.id),
+                       *(post_key(similar.id) for similar in similar_posts))
 
     return render(request, 'blog/post/detail.html', {
         'post': post,
@@ -192,3 +260,58 @@ def post_detail(request, year, month, day, post):
         'form': form,
         'similar_posts': similar_posts,
     })
+
+
+# The comments following the `after` cursor, for the "Load more comments" link
+# of post_detail: an HTML fragment, or JSON for an Accept: application/json request
+# {"comments": [{"id", "name", "body", "created"}, ...], "next": cursor or null}
+@declare_query_budget(2)
+@read_only_view
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.published.only('id'), id=post_id)
+    try:
+        comments = paginate_comments(post, after=request.GET.get('after'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor.')
+
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({
+            'comments': [{'id': comment.id, 'name': comment.name, 'body': comment.body,
+                          'created': comment.created} for comment in comments],
+            'next': comments.next_cursor,
+        })
+    # Numbering of the comments continues from the loaded ones
+    start = request.GET.get('start', '')
+    return render(request, 'blog/post/includes/comments.html', {
+        'post': post,
+        'comments': comments,
+        'start': int(start) if start.isdigit() else 0,
+    })
+
+
+def get_similar_posts(post, count=SIMILAR_POSTS_KEPT):
+    return [
+        link.similar_post for link in
+        SimilarPost.objects.filter(post=post)
+        .select_related('similar_post')
+        .only('similar_post', 'similar_post__title', 'similar_post__slug',
+              'similar_post__publish')
+        .order_by('-shared_tag_count', '-similar_publish', '-similar_post')[:count]
+    ]
+
+
+# Export posts or comments, e.g. /blog/export/comments.csv?active=1&since=2024-01-01
+# The rows are streamed, see blog.export
+@declare_query_budget(5)
+@staff_member_required
+def export(request, model, format):
+    if model not in EXPORTS or format not in FORMATS:
+        raise Http404
+    model_class, fields = EXPORTS[model]
+    if not request.user.has_perm(f'blog.view_{model_class._meta.model_name}'):
+        raise PermissionDenied
+    try:
+        queryset = filter_export(model_class, request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return export_response(queryset, fields, format, model, request)
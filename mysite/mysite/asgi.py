@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+# The async versions of the blog read views are opt-in, see
+# settings.BLOG_ASYNC_VIEWS before setting BLOG_ASYNC_VIEWS=True
 
 application = get_asgi_application()
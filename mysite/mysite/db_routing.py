@@ -0,0 +1,186 @@
+"""
+Read-replica routing.
+
+Views that only read declare it, like query budgets:
+
+    @read_only_view
+    def post_list(request): ...
+
+    class IndexView(generic.ListView):
+        read_only = True
+
+and while such a view runs, ReplicaRouter sends its reads to the `replica`
+database (when settings.DATABASES has one). Everything else, and every
+write, uses `default`.
+
+A replica lags a little behind the primary, so a visitor who just wrote
+(posted a comment, voted) would not see their own change on the next page.
+ReplicaMiddleware therefore sets a short-lived cookie after any request that
+wrote, and requests carrying it read from the primary as well.
+
+Caches have the same problem: a fill running right after a change is made
+visible would store what the replica still has under the new version. Code
+filling them reads through reading_from_primary() while a change is younger
+than REPLICA_LAG_SECONDS.
+"""
+
+import contextlib
+import contextvars
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+# Longer than the replication lag we expect
+STICKY_COOKIE = 'use_primary'
+STICKY_SECONDS = 10
+REPLICA_LAG_SECONDS = STICKY_SECONDS
+
+
+@dataclass
+class RoutingState:
+    read_only: bool = False
+    sticky: bool = False
+    wrote: bool = False
+    primary: bool = False
+    replica_read: bool = False
+
+
+# One state per request. Mutated rather than re-set, so changes made in a
+# copied context (sync_to_async, threads) are still seen by the middleware.
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def read_only_view(view_func):
+    """
+    Mark a function-based view as safe to serve from the replica.
+    """
+    view_func.read_only = True
+    return view_func
+
+
+def is_read_only_view(view):
+    """
+    Return whether a resolved view callable (function view, class-based view
+    or callable instance such as a Feed) was declared read-only.
+    """
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'read_only', False)
+    return getattr(view, 'read_only', False)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def reads_from_replica():
+    """
+    Return whether reads made now, in the current request, go to the replica.
+    """
+    state = _state.get()
+    return (state is not None and state.read_only and not state.sticky and not state.wrote
+            and not state.primary and replica_configured())
+
+
+def read_from_replica():
+    """
+    Return whether the current request has read anything from the replica.
+    """
+    state = _state.get()
+    return state is not None and state.replica_read
+
+
+@contextlib.contextmanager
+def reading_from_primary():
+    """
+    Send the reads of the block to the primary, even in a read-only view.
+    """
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    primary = state.primary
+    state.primary = True
+    try:
+        yield
+    finally:
+        state.primary = primary
+
+
+class ReplicaRouter:
+    """
+    Send the reads of read-only views to the replica, unless the visitor
+    recently wrote. The replica mirrors `default`, so both hold every model.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reads_from_replica():
+            _state.get().replica_read = True
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Read the rest of this request from the primary too
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both, objects read from either may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """
+    Track the routing state of each request, and keep visitors who wrote on
+    the primary for STICKY_SECONDS. Works under WSGI and ASGI, so async
+    views are not forced back into a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state)
+
+    def start(self, request):
+        state = RoutingState(sticky=STICKY_COOKIE in request.COOKIES)
+        return state, _state.set(state)
+
+    def finish(self, request, response, state):
+        if state.wrote or request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None:
+            state.read_only = is_read_only_view(view_func)
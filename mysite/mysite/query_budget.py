@@ -0,0 +1,75 @@
+"""
+Query budgets for views.
+
+Views declare how many SQL queries a request may cost:
+
+    @declare_query_budget(5)
+    def post_list(request): ...
+
+    class IndexView(generic.ListView):
+        query_budget = 1
+
+and tests enforce them with the `query_budget` context manager/decorator,
+which fails as soon as the wrapped block runs more queries than allowed.
+"""
+
+from contextlib import ContextDecorator
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail with QueryBudgetExceeded when the block runs more than `max_queries`
+    queries on the `using` database.
+    """
+
+    def __init__(self, max_queries, using=DEFAULT_DB_ALIAS, label=None):
+        self.max_queries = max_queries
+        self.using = using
+        self.label = label
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context)
+        if executed > self.max_queries:
+            queries = '\n'.join(
+                f'{i}. {query["sql"]}'
+                for i, query in enumerate(self.context.captured_queries, start=1))
+            raise QueryBudgetExceeded(
+                f'{self.label or "Block"} ran {executed} queries, '
+                f'over its budget of {self.max_queries}:\n{queries}')
+        return False
+
+
+def declare_query_budget(max_queries):
+    """
+    Record the query budget of a function-based view.
+    """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view):
+    """
+    Return the budget declared by a resolved view callable (function view,
+    class-based view or callable instance such as a Feed), or None.
+    """
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'query_budget', None)
+    return getattr(view, 'query_budget', None)
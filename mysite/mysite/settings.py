@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import sys
 from pathlib import Path
 
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -26,9 +26,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-w^*=siw7b4idikl5&^-9giwb!x(s8k(lqwa9_z8(+nti+)@ru&'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=True, cast=bool)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='', cast=Csv())
 
 SITE_ID = 1
 
@@ -63,6 +63,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Routes the reads of read-only views to the read replica
+    'mysite.db_routing.ReplicaMiddleware',
 ]
 
 
@@ -73,7 +75,7 @@ INTERNAL_IPS = [
 
 
 TESTING = "test" in sys.argv
-if not TESTING:
+if DEBUG and not TESTING:
     INSTALLED_APPS = [
         *INSTALLED_APPS,
         "debug_toolbar",
@@ -116,6 +118,15 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # Seconds a connection is kept for the next request, 0 closes it at
+        # the end of every request. Keep connections when BLOG_ASYNC_VIEWS is on.
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Titles more than 10% similar match the post search (the % trigram
+            # operator, see blog.search.search_posts), pg_trgm's default is 0.3
+            'options': '-c pg_trgm.similarity_threshold=0.1',
+        },
     }
     # 'default': {
     #     'ENGINE': 'django.db.backends.sqlite3',
@@ -123,6 +134,63 @@ DATABASES = {
     # }
 }
 
+# Optional read replica of `default`, used by the read-only views (see
+# mysite/db_routing.py). Set DB_REPLICA_NAME, and DB_REPLICA_HOST/PORT when
+# it runs elsewhere, to enable it. Tests use `default` only, the routing
+# tests record the router's choices instead.
+if config('DB_REPLICA_NAME', default='') and not TESTING:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME'),
+        'HOST': config('DB_REPLICA_HOST', default=DATABASES['default']['HOST']),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+    }
+
+DATABASE_ROUTERS = ['mysite.db_routing.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# LocMemCache is per process. In production use a shared backend such as
+# django.core.cache.backends.redis.RedisCache so that signal-driven
+# invalidations reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Ids of the posts matching recent search queries, see blog/search.py.
+    # LocMemCache evicts the least recently used entries beyond MAX_ENTRIES.
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search',
+        'TIMEOUT': 60 * 10,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+
+# Polls vote buffering
+# When enabled, votes are inserted into polls.PendingVote and added to
+# Choice.votes in batches by a worker running `manage.py flush_votes --loop`
+# every flush interval (seconds), see polls/votes.py. Without the worker the
+# buffered votes are shown in the results but never flushed.
+
+POLLS_BUFFER_VOTES = config('POLLS_BUFFER_VOTES', default=False, cast=bool)
+POLLS_VOTE_FLUSH_INTERVAL = config('POLLS_VOTE_FLUSH_INTERVAL', default=5, cast=float)
+
+
+# Async blog views
+# Serve the post list, detail and search pages with the async views of
+# blog/async_views.py, which run their independent queries concurrently.
+# Off by default, and only worth trying under ASGI. Every concurrent query
+# runs in a worker thread with its own connection, so with DB_CONN_MAX_AGE
+# at 0 a cold-cache page opens 4-5 new Postgres connections. Set
+# DB_CONN_MAX_AGE (e.g. 60), or put a pooler such as PgBouncer in front of
+# Postgres, before turning it on. Compare with `manage.py loadtest --server compare`:
+# on one CPU the async views served 0.67x the requests of the WSGI ones.
+BLOG_ASYNC_VIEWS = config('BLOG_ASYNC_VIEWS', default=False, cast=bool)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -160,6 +228,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Directory written by `manage.py build_sitemaps`, to be served by the web
+# server at the site root in front of the dynamic sitemap views
+
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -0,0 +1,214 @@
+import datetime
+from unittest import mock
+
+from blog import urls as blog_urls
+from blog.cache import cached, invalidate
+from blog.models import Comment, Post
+from blog.pagecache import _page_key, post_key
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.test import RequestFactory, TestCase
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from polls import urls as polls_urls
+from polls.models import Choice, Question
+
+from .db_routing import REPLICA_DB_ALIAS, STICKY_COOKIE, ReplicaRouter, RoutingState, _state
+from .query_budget import QueryBudgetExceeded, get_query_budget, query_budget
+
+
+def url_names(urlconf):
+    """
+    Yield (name, callback) of every named pattern in `urlconf`.
+    """
+    for pattern in urlconf.urlpatterns:
+        if isinstance(pattern, URLResolver):
+            continue
+        yield pattern.name, pattern.callback
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Request every URL of blog.urls and polls.urls with a cold cache and fail
+    when a view runs more queries than it declares.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # Several authors, tags and comments so per-row queries would show up
+        cls.posts = []
+        for i in range(4):
+            author = User.objects.create_user(f'author{i}')
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author,
+                                       body=f'Body of post {i}.', status=Post.Status.PUBLISHED,
+                                       publish=now - datetime.timedelta(days=i))
+            post.tags.add('django', f'tag{i}')
+            for j in range(2):
+                Comment.objects.create(post=post, name=f'Reader {j}',
+                                       email='reader@example.com', body='Nice post.')
+            cls.posts.append(post)
+        cls.question = Question.objects.create(
+            question_text='What is up?', pub_date=now - datetime.timedelta(days=1))
+        cls.choices = [Choice.objects.create(question=cls.question, choice_text=text)
+                       for text in ('Not much', 'The sky')]
+
+    def requests(self):
+        """
+        Return {url name: (method, url, data)} covering every named URL.
+        """
+        post = self.posts[0]
+        question_args = [self.question.id]
+        return {
+            'blog:post_list': ('get', reverse('blog:post_list'), {}),
+            'blog:post_list_by_tag': ('get', reverse('blog:post_list_by_tag', args=['django']), {}),
+            'blog:post_detail': ('get', post.get_absolute_url(), {}),
+            'blog:post_share': ('get', reverse('blog:post_share', args=[post.id]), {}),
+            'blog:post_comment': ('post', reverse('blog:post_comment', args=[post.id]),
+                                  {'name': 'Reader', 'email': 'reader@example.com', 'body': 'Hi'}),
+            'blog:post_comments': ('get', reverse('blog:post_comments', args=[post.id]), {}),
+            'blog:post_feed': ('get', reverse('blog:post_feed'), {}),
+            'blog:tag_list': ('get', reverse('blog:tag_list'), {}),
+            'blog:post_feed_by_tag': ('get', reverse('blog:post_feed_by_tag', args=['django']), {}),
+            'blog:post_search': ('get', reverse('blog:post_search'), {'query': 'post'}),
+            'blog:post_autocomplete': ('get', reverse('blog:post_autocomplete'), {'q': 'pos'}),
+            'blog:export': ('get', reverse('blog:export', args=['comments', 'csv']), {}),
+            'polls:index': ('get', reverse('polls:index'), {}),
+            'polls:detail': ('get', reverse('polls:detail', args=question_args), {}),
+            'polls:results': ('get', reverse('polls:results', args=question_args), {}),
+            'polls:vote': ('post', reverse('polls:vote', args=question_args),
+                           {'choice': self.choices[0].id}),
+        }
+
+    def test_every_view_stays_within_its_budget(self):
+        requests = self.requests()
+        for urlconf in (blog_urls, polls_urls):
+            for name, view in url_names(urlconf):
+                name = f'{urlconf.app_name}:{name}'
+                with self.subTest(url=name):
+                    budget = get_query_budget(view)
+                    self.assertIsNotNone(budget, f'{name} does not declare a query budget')
+                    self.assertIn(name, requests, f'No budget test request for {name}')
+                    method, url, data = requests[name]
+                    cache.clear()
+                    with query_budget(budget, label=name):
+                        response = getattr(self.client, method)(url, data)
+                    self.assertLess(response.status_code, 400)
+
+    def test_query_budget_fails_when_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(Post.objects.all())
+                list(Comment.objects.all())
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Reads of read-only views go to the replica, unless the visitor wrote.
+    The decisions of ReplicaRouter are recorded, and the queries still run
+    on `default` so no second database is needed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title='Replicated', slug='replicated', author=author,
+                                       body='Body.', status=Post.Status.PUBLISHED)
+
+    def routed_reads(self, method, url, data=None):
+        """
+        Request `url` and return (response, set of aliases chosen for reads).
+        """
+        aliases = set()
+        route = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            aliases.add(route(router, model, **hints))
+            return DEFAULT_DB_ALIAS
+
+        cache.clear()
+        # cache.clear() restarts every version, which counts as a change the
+        # replica may not have yet
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy), \
+                mock.patch('mysite.db_routing.replica_configured', return_value=True), \
+                mock.patch('blog.cache.REPLICA_LAG_SECONDS', 0):
+            response = getattr(self.client, method)(url, data or {})
+        return response, aliases
+
+    def test_read_only_views_read_from_the_replica(self):
+        for url in (reverse('blog:post_list'), self.post.get_absolute_url(),
+                    reverse('blog:post_feed'), reverse('polls:index'), '/sitemap.xml'):
+            with self.subTest(url=url):
+                response, aliases = self.routed_reads('get', url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(aliases, {REPLICA_DB_ALIAS})
+                self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_other_views_read_from_the_primary(self):
+        response, aliases = self.routed_reads('get', reverse('blog:post_share', args=[self.post.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {DEFAULT_DB_ALIAS})
+
+    def test_writing_sticks_to_the_primary(self):
+        response, _ = self.routed_reads('post', reverse('blog:post_comment', args=[self.post.id]),
+                                        {'name': 'Reader', 'email': 'reader@example.com',
+                                         'body': 'Hi'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        # The test client sends the cookie back, the next page sees the comment
+        response, aliases = self.routed_reads('get', self.post.get_absolute_url())
+        self.assertEqual(aliases, {DEFAULT_DB_ALIAS})
+
+        self.client.cookies.pop(STICKY_COOKIE)
+        response, aliases = self.routed_reads('get', self.post.get_absolute_url())
+        self.assertEqual(aliases, {REPLICA_DB_ALIAS})
+
+    def test_caches_are_not_filled_from_a_lagging_replica(self):
+        """
+        Right after a change, cached values are computed from the primary,
+        and pages that read from the replica are not stored, so what the
+        replica still has can't be cached under the new version.
+        """
+        def where():
+            return ReplicaRouter().db_for_read(Post)
+
+        cache.clear()
+        with mock.patch('mysite.db_routing.replica_configured', return_value=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                invalidate('posts')
+            token = _state.set(RoutingState(read_only=True))
+            try:
+                self.assertEqual(cached('posts', 'source', where), DEFAULT_DB_ALIAS)
+                with mock.patch('blog.cache.REPLICA_LAG_SECONDS', 0):
+                    self.assertEqual(cached('posts', 'other', where), REPLICA_DB_ALIAS)
+            finally:
+                _state.reset(token)
+
+        aliases = set()
+        route = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            aliases.add(route(router, model, **hints))
+            return DEFAULT_DB_ALIAS
+
+        url = self.post.get_absolute_url()
+        page_key = _page_key(RequestFactory().get(url))
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy), \
+                mock.patch('mysite.db_routing.replica_configured', return_value=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                invalidate(post_key(self.post.id))
+            self.client.get(url)
+            self.assertIn(REPLICA_DB_ALIAS, aliases)
+            self.assertIsNone(cache.get(page_key))
+
+            with mock.patch('blog.cache.REPLICA_LAG_SECONDS', 0):
+                self.client.get(url)
+            self.assertIsNotNone(cache.get(page_key))
+
+    def test_without_replica_everything_uses_default(self):
+        token = _state.set(RoutingState(read_only=True))
+        try:
+            with mock.patch('mysite.db_routing.replica_configured', return_value=False):
+                self.assertEqual(ReplicaRouter().db_for_read(Post), DEFAULT_DB_ALIAS)
+        finally:
+            _state.reset(token)
@@ -1,17 +1,28 @@
+from blog.conditional import conditional_view, sitemap_validators
 from blog.sitemaps import PostSitemap
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
+from django.contrib.sitemaps import views as sitemap_views
 from django.urls import include, path
+from mysite.db_routing import read_only_view
 
 sitemaps = {
     'posts': PostSitemap
 }
 
 urlpatterns = [
-    path("__debug__/", include("debug_toolbar.urls")),
     path('admin/', admin.site.urls),
     path('polls/', include('polls.urls')),
     path('blog/', include('blog.urls', namespace='blog')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps},
+    # Sitemap index, pointing at one sitemap page per PostSitemap.limit URLs.
+    # `manage.py build_sitemaps` pre-generates the same content as static files.
+    path('sitemap.xml', read_only_view(conditional_view(sitemap_validators)(sitemap_views.index)),
+         {'sitemaps': sitemaps}),
+    path('sitemap-<section>.xml',
+         read_only_view(conditional_view(sitemap_validators)(sitemap_views.sitemap)),
+         {'sitemaps': sitemaps},
          name='django.contrib.sitemaps.views.sitemap')
 ]
+
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.insert(0, path("__debug__/", include("debug_toolbar.urls")))
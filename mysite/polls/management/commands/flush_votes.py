@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.votes import flush_votes
+
+
+class Command(BaseCommand):
+    help = "Move buffered votes into Choice.votes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep flushing every --interval seconds.")
+        parser.add_argument("--interval", type=float,
+                            default=settings.POLLS_VOTE_FLUSH_INTERVAL,
+                            help="Seconds between flushes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = flush_votes()
+            self.stdout.write(f"Flushed {flushed} votes.")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -30,3 +30,17 @@ class Choice(models.Model):
 
     def __str__(self):
         return self.choice_text
+
+
+class PendingVote(models.Model):
+    """
+    A vote not yet added to Choice.votes, used when POLLS_BUFFER_VOTES is on.
+    Votes are inserted here instead of updating the hot Choice row, and
+    polls.votes.flush_votes() moves them to Choice.votes in batches.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Pending vote for {self.choice_id}"
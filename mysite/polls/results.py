@@ -0,0 +1,46 @@
+from django.core.cache import cache
+
+from .models import Choice
+from .votes import pending_votes
+
+# Results are invalidated on every vote, the timeout only bounds the life of
+# entries for polls nobody votes on anymore
+RESULTS_TIMEOUT = 60 * 60
+
+
+def results_key(question_id):
+    return f"polls:results:{question_id}"
+
+
+def get_results(question):
+    """
+    Return the cached results of `question`:
+    {"choices": [{"id", "choice_text", "votes", "percent"}, ...], "total": int}
+    Votes still in the vote buffer are included.
+    """
+    key = results_key(question.id)
+    results = cache.get(key)
+    if results is None:
+        results = build_results(question)
+        cache.set(key, results, RESULTS_TIMEOUT)
+    return results
+
+
+def build_results(question):
+    # One statement reads Choice.votes and the buffered votes from the same
+    # snapshot
+    choices = [
+        {"id": choice_id, "choice_text": text, "votes": votes + pending}
+        for choice_id, text, votes, pending in Choice.objects.filter(question=question)
+        .annotate(pending=pending_votes())
+        .order_by("id")
+        .values_list("id", "choice_text", "votes", "pending")
+    ]
+    total = sum(choice["votes"] for choice in choices)
+    for choice in choices:
+        choice["percent"] = round(100 * choice["votes"] / total, 1) if total else 0
+    return {"choices": choices, "total": total}
+
+
+def invalidate_results(question_id):
+    cache.delete(results_key(question_id))
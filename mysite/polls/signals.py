@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Choice, PendingVote, Question
+from .results import invalidate_results
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def invalidate_choice_results(sender, instance, **kwargs):
+    invalidate_results(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_results(sender, instance, **kwargs):
+    invalidate_results(instance.id)
+
+
+# Cached results include buffered votes, so a new pending vote changes them
+# while flushing it into Choice.votes does not
+@receiver(post_save, sender=PendingVote)
+def invalidate_pending_vote_results(sender, instance, created, **kwargs):
+    invalidate_results(instance.question_id)
@@ -1,10 +1,13 @@
 import datetime
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Question
+from .models import Choice, PendingVote, Question
+from .results import build_results
+from .votes import flush_votes
 
 
 def create_question(question_text, days):
@@ -124,3 +127,87 @@ class QuestionDetailViewTest(TestCase):
         url = reverse("polls:detail", args=(past_question.id,))
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
+
+
+@override_settings(POLLS_BUFFER_VOTES=True, POLLS_VOTE_FLUSH_INTERVAL=60)
+class BufferedVoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Buffered?", days=-1)
+        self.yes = Choice.objects.create(question=self.question, choice_text="Yes")
+        self.no = Choice.objects.create(question=self.question, choice_text="No")
+
+    def vote(self, choice):
+        return self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": choice.id})
+
+    def test_votes_are_buffered_and_flushed_in_batches(self):
+        """
+        Votes stay pending, the request never flushes them, and a flush adds
+        them to Choice.votes all at once.
+        """
+        for choice in (self.yes, self.yes, self.no):
+            with self.assertNumQueries(3):
+                self.vote(choice)
+        self.yes.refresh_from_db()
+        self.assertEqual(self.yes.votes, 0)
+        self.assertEqual(PendingVote.objects.count(), 3)
+
+        self.assertEqual(flush_votes(), 3)
+        self.yes.refresh_from_db()
+        self.no.refresh_from_db()
+        self.assertEqual((self.yes.votes, self.no.votes), (2, 1))
+        self.assertFalse(PendingVote.objects.exists())
+
+    def test_results_include_pending_votes(self):
+        """
+        The results page shows votes that have not been flushed yet.
+        """
+        self.vote(self.yes)
+        self.vote(self.no)
+        response = self.client.get(reverse("polls:results", args=(self.question.id,)))
+        votes = {choice["choice_text"]: choice["votes"]
+                 for choice in response.context["results"]["choices"]}
+        self.assertEqual(votes, {"Yes": 1, "No": 1})
+
+    def test_results_read_votes_and_pending_votes_together(self):
+        """
+        Buffered votes are counted in the same query as Choice.votes, so a
+        flush committing in between can't count them twice.
+        """
+        self.vote(self.yes)
+        self.vote(self.yes)
+        self.vote(self.no)
+        with self.assertNumQueries(1):
+            results = build_results(self.question)
+        self.assertEqual(results["total"], 3)
+        flush_votes()
+        self.assertEqual(build_results(self.question), results)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Cached?", days=-1)
+        self.yes = Choice.objects.create(question=self.question, choice_text="Yes", votes=3)
+        self.no = Choice.objects.create(question=self.question, choice_text="No", votes=1)
+        self.url = reverse("polls:results", args=(self.question.id,))
+
+    def test_results_are_cached_with_totals(self):
+        """
+        The results page computes totals and percentages once, then only
+        loads the question.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["results"]["total"], 4)
+        self.assertEqual([c["percent"] for c in response.context["results"]["choices"]], [75.0, 25.0])
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_vote_invalidates_results(self):
+        """
+        Voting refreshes the cached results of the question.
+        """
+        self.client.get(self.url)
+        self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": self.no.id})
+        response = self.client.get(self.url)
+        self.assertContains(response, "No -- 2 votes (40.0%)")
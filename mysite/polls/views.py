@@ -1,18 +1,23 @@
-from django.db.models import F
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.template import loader
 from django.urls import reverse
 from django.utils import timezone
 from django.views import generic
+from mysite.query_budget import declare_query_budget
 
 from .models import Choice, Question
+from .results import get_results
+from .votes import record_vote
 
 
 # generic Views to avoid duplicated codes
 class IndexView(generic.ListView):
     template_name = "polls/index.html"
     context_object_name = "latest_question_list"
+    query_budget = 1
+    # Served from the read replica, see mysite.db_routing
+    read_only = True
 
     def get_queryset(self):
         """
@@ -25,6 +30,8 @@ class IndexView(generic.ListView):
 class DetailView(generic.DetailView):
     model = Question
     template_name = "polls/detail.html"
+    query_budget = 2
+    read_only = True
 
     def get_queryset(self):
         """
@@ -32,10 +39,24 @@ class DetailView(generic.DetailView):
         """
         return Question.objects.filter(pub_date__lte=timezone.now())
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Choices come from the results cache instead of choice_set
+        context["results"] = get_results(self.object)
+        return context
+
 
 class ResultsView(generic.DetailView):
     model = Question
     template_name = "polls/results.html"
+    query_budget = 2
+    read_only = True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Cached choices, votes (including buffered ones), total and percentages
+        context["results"] = get_results(self.object)
+        return context
 
 
 comment = '''
@@ -71,6 +92,7 @@ def results(request, question_id):
 '''
 
 
+@declare_query_budget(3)
 def vote(request, question_id):
     question = get_object_or_404(Question, pk=question_id)
 
@@ -78,10 +100,12 @@ def vote(request, question_id):
         selected_choice = question.choice_set.get(pk=request.POST["choice"])
     except (KeyError, Choice.DoesNotExist):
         # Redisplay the question voting form.
-        return render(request, "polls/detail.html", {"question": question, "error_message": "You didn't select a choice."})
+        return render(request, "polls/detail.html", {"question": question, "results": get_results(question), "error_message": "You didn't select a choice."})
     else:
-        selected_choice.votes = F("votes") + 1
-        selected_choice.save()
+        # selected_choice.votes = F("votes") + 1
+        # selected_choice.save()
+        # Direct F() update, or buffered when POLLS_BUFFER_VOTES is on
+        record_vote(selected_choice)
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
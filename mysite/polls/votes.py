@@ -0,0 +1,76 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Choice, PendingVote
+
+
+def buffering_enabled():
+    return getattr(settings, "POLLS_BUFFER_VOTES", False)
+
+
+def record_vote(choice):
+    """
+    Count one vote for `choice`, either directly on the row or through the
+    vote buffer.
+    """
+    if not buffering_enabled():
+        # the Choice post_save signal invalidates the cached results
+        choice.votes = F("votes") + 1
+        choice.save(update_fields=["votes"])
+        return
+    # An INSERT does not wait on the row lock of a popular choice. The
+    # `flush_votes` command moves the votes to Choice.votes, never the request.
+    PendingVote.objects.create(question_id=choice.question_id, choice=choice)
+
+
+def flush_votes(batch_size=10000):
+    """
+    Move pending votes to Choice.votes and return the number of votes moved.
+
+    Each batch deletes its pending rows and adds them to the choices in the
+    same transaction, so a crash either keeps the votes pending or has
+    counted them, never both. SKIP LOCKED lets concurrent flushes take
+    disjoint batches.
+    """
+    table = PendingVote._meta.db_table
+    flushed = 0
+    while True:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"SELECT id FROM {table} ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+                    f") RETURNING choice_id",
+                    [batch_size],
+                )
+                counts = Counter(choice_id for choice_id, in cursor.fetchall())
+            if not counts:
+                return flushed
+            # One UPDATE for the whole batch
+            Choice.objects.filter(pk__in=counts).update(votes=F("votes") + Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in counts.items()],
+                default=Value(0),
+            ))
+        flushed += sum(counts.values())
+
+
+def pending_votes():
+    """
+    Return an expression counting the votes still buffered for each Choice,
+    to annotate a Choice queryset with. Being part of the same query as
+    Choice.votes, a flush can't commit between the two reads and have its
+    votes counted twice.
+    """
+    if not buffering_enabled():
+        return Value(0)
+    buffered = (
+        PendingVote.objects.filter(choice=OuterRef("pk"))
+        .values("choice")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    return Coalesce(Subquery(buffered), 0)